@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+# bench.py
+# micro benchmarks for the simplepub storage code
+
+# ---------------------------------------------------------------------------
+
+def make_feeds(path, nfeeds, nentries, size): # [(fid, [(entry, [chunks])])]
+    feeds = []
+    for i in range(nfeeds):
+        fid, skvk = pure25519.publickey(os.urandom(32))
+        author = replica.Replica(path, fid, VERIFY, is_author=True)
+        sign = lambda m, skvk=skvk: pure25519.sign(m, skvk)[:64]
+        for k in range(nentries):
+            if k % 2 == 0:
+                author.write48(os.urandom(48), sign)
+            else:
+                author.write(os.urandom(size), sign)
+        entries = []
+        for seq in range(1, nentries+1):
+            chunks = []
+            while True:
+                c = author.get_chunk_pkt(seq, len(chunks))
+                if c == None:
+                    break
+                chunks.append(c)
+            entries.append((author.get_entry_pkt(seq), chunks))
+        feeds.append((fid, entries))
+    return feeds
+
+def bench_durability(args):
+    print(f"ingest {args.f} feeds x {args.n} entries " +
+          f"(every 2nd with {args.size}B sidechain), flush every {args.t}ms")
+    src = tempfile.mkdtemp()
+    feeds = make_feeds(src, args.f, args.n, args.size)
+    vf = VERIFY if not args.verify else \
+         lambda pk,sig,msg: pure25519.open(sig+msg, pk) != None
+    for mode in replica.DURABILITY:
+        dst = tempfile.mkdtemp(dir=args.d)
+        reps = [replica.Replica(dst, fid, vf, durability=mode)
+                for fid,_ in feeds]
+        ecnt, ccnt = 0, 0
+        t0 = time.time()
+        last = t0
+        for seq in range(1, args.n+1):
+            for r, (_,entries) in zip(reps, feeds):
+                pkt, chunks = entries[seq-1]
+                ecnt += r.ingest_entry_pkt(pkt, seq)
+                for c in chunks:
+                    ccnt += r.ingest_chunk_pkt(c, seq)
+            if time.time() - last >= args.t/1000: # periodic flush, as a node
+                for r in reps:
+                    r.flush()
+                last = time.time()
+        for r in reps:
+            r.flush()
+        t = time.time() - t0
+        print(f"  {mode:8}  {t:7.3f}s  {ecnt/t:9.1f} entries/s" +
+              f"  {ccnt/t:9.1f} chunks/s")
+        shutil.rmtree(dst)
+    shutil.rmtree(src)
+
+def bench_serve(args):
+    # allocations per served packet, answering WANT and CHNK requests
+    print(f"serve {args.f} feeds x {args.n} entries " +
+          f"(every 2nd with {args.size}B sidechain)")
+    src = tempfile.mkdtemp(dir=args.d)
+    feeds = make_feeds(src, args.f, args.n, args.size)
+    pck = tempfile.mkdtemp(dir=args.d) # same feeds, in a packfile
+    store = pack.PackStore(pck)
+    for fid, entries in feeds:
+        r = pack.PackReplica(store, fid, VERIFY)
+        for pkt, chunks in entries:
+            r.import_entry(pkt, chunks)
+    store.close()
+    for backend, path in [('2fpf', src), ('pack', pck)]:
+        for use_mmap in [False, True]:
+            node = node_mod.PubNode(path, 'out', use_mmap=use_mmap,
+                                    backend=backend)
+            reqs = []
+            for fid, entries in feeds:
+                ndx = node.goset._key_to_ndx(fid)
+                for seq in range(1, args.n+1, 3): # 3 pkts per request
+                    reqs.append(node.want_dmx + bipf.dumps([ndx, seq]))
+                for seq in range(2, args.n+1, 2):
+                    for cnr in range(0, len(entries[seq-1][1]), 3):
+                        reqs.append(node.chnk_dmx + bipf.dumps([[ndx,seq,cnr]]))
+            for r in reqs: # warm up: open replicas, map files
+                node.rx(r)
+            out = []
+            tracemalloc.start()
+            s0 = tracemalloc.take_snapshot()
+            t0 = time.time()
+            for r in reqs:
+                out += node.rx(r) # kept, as if queued for the websocket
+            t = time.time() - t0
+            s1 = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            stats = s1.compare_to(s0, 'filename')
+            blocks = sum(x.count_diff for x in stats)
+            nbytes = sum(x.size_diff for x in stats)
+            n = max(len(out), 1)
+            print(f"  {backend:4} mmap={str(use_mmap):5}  {len(out):6} pkts" +
+                  f"  {blocks/n:5.2f} blocks/pkt  {nbytes/n:7.1f} B/pkt" +
+                  f"  {1000000*t/n:6.1f} us/pkt (traced)")
+            del out
+            node.close()
+    shutil.rmtree(src)
+    shutil.rmtree(pck)
+
+def bench_verify(args):
+    # signature checks of one feed's entries: one by one, and in batches as
+    # a node verifies the entries buffered for a feed (-b)
+    print(f"verify {args.n} signatures, batches of {args.b}")
+    fid, skvk = pure25519.publickey(os.urandom(32))
+    items = []
+    for i in range(args.n):
+        msg = os.urandom(64)
+        items.append((fid, pure25519.sign(msg, skvk)[:64], msg))
+    t0 = time.time()
+    for vk, sig, msg in items:
+        pure25519.open(sig + msg, vk)
+    t = time.time() - t0
+    print(f"  {'open()':24} {1000*t/args.n:7.2f} ms/sig")
+    t0 = time.time()
+    for i in range(0, args.n, args.b):
+        assert all(pure25519.verify_batch(items[i:i+args.b]))
+    t = time.time() - t0
+    print(f"  {'verify_batch()':24} {1000*t/args.n:7.2f} ms/sig")
+    for name in crypto.BACKENDS: # as used by a node, if installed
+        v = crypto.load(name)
+        if v == None:
+            print(f"  {name}: not installed")
+            continue
+        v.verify(*items[0]) # pure25519: the decoded key is then cached
+        t0 = time.time()
+        for vk, sig, msg in items:
+            v.verify(vk, sig, msg)
+        t = time.time() - t0
+        print(f"  {name+'.verify()':24} {1000*t/args.n:7.2f} ms/sig")
+        t0 = time.time()
+        for i in range(0, args.n, args.b):
+            assert all(v.verify_batch(items[i:i+args.b]))
+        t = time.time() - t0
+        print(f"  {name+'.verify_batch()':24} {1000*t/args.n:7.2f} ms/sig")
+
+def bench_base(args):
+    # n*B with the fixed-base table vs. the generic double-and-add
+    print(f"{args.n} multiplications of the base point")
+    ns = [int.from_bytes(os.urandom(32), 'little') % basic.L
+          for i in range(args.n)]
+    t0 = time.time()
+    basic._get_base_table()
+    print(f"  table built in {1000*(time.time()-t0):.1f} ms")
+    t0 = time.time()
+    slow = [basic.scalarmult_element(basic.Base.XYTZ, n) for n in ns]
+    t1 = time.time()
+    fast = [pure25519.Base.scalarmult(n).XYTZ for n in ns]
+    t2 = time.time()
+    assert all(basic.Element(a) == basic.Element(b)
+               for a, b in zip(slow, fast))
+    print(f"  generic        {1000*(t1-t0)/args.n:7.2f} ms/mult")
+    print(f"  fixed-base     {1000*(t2-t1)/args.n:7.2f} ms/mult" +
+          f"  ({(t1-t0)/(t2-t1):.1f}x)")
+    skvk = pure25519.publickey(os.urandom(32))[1]
+    t0 = time.time()
+    for i in range(args.n):
+        pure25519.sign(b'', skvk)
+    print(f"  sign()         {1000*(time.time()-t0)/args.n:7.2f} ms/sig")
+
+def open_separate(sigmsg, vk): # open() before the joint multiplication
+    R = basic.bytes_to_element(sigmsg[:32])
+    A = basic.bytes_to_element(vk)
+    S = basic.bytes_to_scalar(sigmsg[32:64])
+    h = pure25519.Hint(sigmsg[:32] + vk + sigmsg[64:])
+    return basic.Base.scalarmult(S) == R.add(A.scalarmult(h))
+
+def bench_open(args):
+    # open() with the joint S*B - h*A vs. two separate multiplications,
+    # both give the same verdicts (tests/test_crypto.py)
+    print(f"open {args.n} signatures")
+    vk, skvk = pure25519.publickey(os.urandom(32))
+    good = [pure25519.sign(os.urandom(64), skvk) for i in range(args.n)]
+    t0 = time.time()
+    for sigmsg in good:
+        open_separate(sigmsg, vk)
+    t1 = time.time()
+    for sigmsg in good:
+        pure25519.open(sigmsg, vk)
+    t2 = time.time()
+    print(f"  separate       {1000*(t1-t0)/args.n:7.2f} ms/sig")
+    print(f"  joint          {1000*(t2-t1)/args.n:7.2f} ms/sig")
+
+VERIFY = lambda pk,sig,msg: True # signatures were checked by the author
+
+if __name__ == '__main__':
+
+    import argparse
+    import os
+    import shutil
+    import tempfile
+    import time
+    import tracemalloc
+
+    import pure25519
+    from pure25519 import basic
+    from simplepub import bipf
+    from simplepub import crypto
+    from simplepub import node as node_mod
+    from simplepub import pack
+    from simplepub import replica
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-b', type=int, default=32, metavar='N',
+                    help='signatures per batch, as -batch of spub.py (default: 32)')
+    ap.add_argument('-d', type=str, default=None, metavar='DIR',
+                    help='directory for the test feeds (default: system tmp)')
+    ap.add_argument('-f', type=int, default=4, metavar='N',
+                    help='number of feeds (default: 4)')
+    ap.add_argument('-n', type=int, default=100, metavar='N',
+                    help='number of entries per feed (default: 100)')
+    ap.add_argument('-size', type=int, default=1000, metavar='B',
+                    help='sidechain content length (default: 1000)')
+    ap.add_argument('-t', type=int, default=100, metavar='MS',
+                    help='flush interval, as commit_ms of spub.py (default: 100)')
+    ap.add_argument('-verify', action='store_true', default=False,
+                    help='include signature verification in the timing')
+    ap.add_argument('bench', choices=['base', 'durability', 'open',
+                                         'serve', 'verify'], nargs='?',
+                    default='durability', help='benchmark to run')
+    args = ap.parse_args()
+
+    if args.bench == 'base':
+        bench_base(args)
+    elif args.bench == 'durability':
+        bench_durability(args)
+    elif args.bench == 'open':
+        bench_open(args)
+    elif args.bench == 'serve':
+        bench_serve(args)
+    elif args.bench == 'verify':
+        bench_verify(args)
+
+# eof
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+# convert.py
+# migrate a 2FPF data directory (a directory per feed) to the packfile
+# backend, which spub.py then picks at startup
+
+# ---------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+    import argparse
+    import os
+    import shutil
+
+    from simplepub import pack, replica
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-d', type=str, default='./data', metavar='DATAPATH',
+                    help='path to persistency directory')
+    ap.add_argument('-rm', action='store_true', default=False,
+                    help='remove the feed directories once converted')
+    args = ap.parse_args()
+
+    keys = [ bytes.fromhex(fn) for fn in os.listdir(args.d)
+             if len(fn) == 64 and os.path.isdir(args.d + '/' + fn)]
+    keys.sort()
+    store = pack.PackStore(args.d)
+    cnt_entries = 0
+    for fid in keys:
+        r = replica.Replica(args.d, fid, None)
+        p = pack.PackReplica(store, fid, None)
+        start = p.state['max_seq'] + 1 # continue an interrupted conversion
+        dfr = r.get_deferred_chains()
+        for seq, pkt in r.iter_entries(start):
+            chunks = []
+            while not seq in dfr:
+                c = r.get_chunk_pkt(seq, len(chunks))
+                if c == None:
+                    break
+                chunks.append(bytes(c))
+            p.import_entry(pkt, chunks, seq in dfr)
+        cnt_entries += p.state['max_seq'] - start + 1
+        r.fpool.close()
+    store.close()
+    print(f"converted {len(keys)} feeds, {cnt_entries} new entries")
+    if args.rm:
+        for fid in keys:
+            shutil.rmtree(args.d + '/' + fid.hex())
+    else:
+        print("the feed directories can now be removed (or use -rm)")
+
+# eof
@@ -23,14 +23,14 @@ def bytes2content(buf):
         buf = bipf.loads(buf)
         return f"bipf({bytes2hex(buf)})"
     except:
-        return buf.decode(error='replace')
+        return bytes(buf).decode(errors='replace')
     
 if __name__ == '__main__':
 
     import argparse
     import os
 
-    from simplepub import bipf, replica
+    from simplepub import bipf, pack, replica
 
     ap = argparse.ArgumentParser()
     ap.add_argument('-d', type=str, default='./data', metavar='DATAPATH',
@@ -41,18 +41,27 @@ if __name__ == '__main__':
                     help='only show stats (no content), default: False')
     args = ap.parse_args()
 
-    keys = [ bytes.fromhex(fn) for fn in os.listdir(args.d)
-             if len(fn) == 64 and os.path.isdir(args.d + '/' + fn)]
+    store = None
+    if os.path.isdir(args.d + '/pack'):
+        store = pack.PackStore(args.d)
+        keys = list(store.feeds.keys())
+    else:
+        keys = [ bytes.fromhex(fn) for fn in os.listdir(args.d)
+                 if len(fn) == 64 and os.path.isdir(args.d + '/' + fn)]
     keys.sort()
 
     cnt_entries = 0
     cnt_chunks = 0
     cnt_missing = 0
     missing = []
+    deferred = []
 
     for i in range(len(keys)):
         fid = keys[i];
-        r = replica.Replica(args.d,fid,None)
+        if store == None:
+            r = replica.Replica(args.d,fid,None)
+        else:
+            r = pack.PackReplica(store,fid,None)
         if not args.stat:
             print(f"* key {i}  {fid.hex()}")
         ms = r.state['max_seq']
@@ -60,9 +69,10 @@ if __name__ == '__main__':
         if not args.stat:
             print(f"  max_seq = {ms}, prev = {r.state['prev'].hex()}")
         psc = r.state['pend_sc']
-        for k in range(ms):
-            e = r.get_entry_pkt(k+1)
-            if e[7] == 1 and not k+1 in psc: # chain20 with full sidechain
+        dsc = r.state['dfr_sc']
+        deferred += [f"{i}.{s}" for s in dsc]
+        for s,e in r.iter_entries():
+            if e[7] == 1 and not s in psc and not s in dsc: # full sidechain
                 clen, sz = bipf.varint_decode(e[8:])
                 clen -= 48 - 20 - sz
                 if clen > 0:
@@ -76,13 +86,18 @@ if __name__ == '__main__':
             if not args.stat:
                 print(f"  pend_sc = {psc}")
         if ms > 0 and not args.stat:
-            for k in range(ms):
-                a,l = r.get_content_len(k+1)
-                print(f"  #{k+1}      "[:10] + f"           {a}/{l} "[-13:], end='')
+            for s,e,c in r.iter_content():
+                a,l = r.get_content_len(s)
+                print(f"  #{s}      "[:10] + f"           {a}/{l} "[-13:], end='')
+                if c == None and e[7] == 1: # incomplete sidechain
+                    c = r.read(s)
+                if c == None:
+                    print('(dropped)' if s in dsc else '?')
+                    continue
                 if args.raw:
-                    print(r.read(k+1).hex())
+                    print(c.hex())
                 else:
-                    print(bytes2content(r.read(k+1)))
+                    print(bytes2content(c))
 
     if not args.stat:
         print()
@@ -91,4 +106,5 @@ if __name__ == '__main__':
     print(f"- {cnt_entries} available entries")
     print(f"- {cnt_chunks} available chunks")
     print(f"- {cnt_missing} missing chunks: {', '.join(missing)}")
+    print(f"- {len(deferred)} dropped sidechains (over budget): {', '.join(deferred)}")
 # eof
@@ -5,7 +5,10 @@ import os
 
 from .basic import (bytes_to_clamped_scalar,
                     bytes_to_scalar, scalar_to_bytes,
-                    bytes_to_element, Base)
+                    bytes_to_element, Base, L, is_extended_zero,
+                    add_elements, multiscalarmult_elements, scalarmult_base,
+                    double_scalarmult_vartime, odd_multiples_vartime,
+                    Element)
 '''
 Used only in ../tinyssb/keystore.py
 __all__ = [
@@ -81,27 +84,83 @@ def sign(msg, skvk):
     sig = R_bytes + scalar_to_bytes(S)
     return sig + msg
 
-def open(sigmsg, vk):
+def decode_key(vk): # (A, odd multiples of A), what open() needs of a vk
+    A = bytes_to_element(vk)
+    return A, odd_multiples_vartime(A.XYTZ)
+
+def open(sigmsg, vk, key_fct=decode_key):
+    # key_fct may return the decoded vk from a cache, see decode_key()
     assert len(vk) == 32
     sig = sigmsg[:64]
     msg = sigmsg[64:]
     try:
         R = bytes_to_element(sig[:32])
-        A = bytes_to_element(vk)
+        A, A_odd = key_fct(vk)
         S = bytes_to_scalar(sig[32:])
+        if S >= L: # RFC 8032 5.1.7, else S+L would be a second signature
+            raise ValueError("S is not reduced mod L")
         h = Hint(sig[:32] + vk + msg)
-        v1 = Base.scalarmult(S)
-        v2 = R.add(A.scalarmult(h))
+        # S*B == R + h*A, checked as S*B - h*A == R in one joint pass
+        v = Element(double_scalarmult_vartime(S, A.XYTZ, (-h) % L, A_odd))
     except ValueError as e:
         raise BadSignatureError(e)
     except Exception as e:
         if str(e) == "decoding point that is not on curve":
             raise BadSignatureError(e)
         raise
-    if v1 != v2:
+    if v != R:
         raise BadSignatureError()
     return msg
 
+def verify_batch(items, key_fct=decode_key): # [(vk,sig,msg)] -> [bool]
+    # checks sum(z_i*R_i) + sum(z_i*h_i*A_i) - sum(z_i*S_i)*B == Zero for
+    # random 128-bit z_i, with one multi-scalar multiplication: a bad
+    # signature passes with probability 2^-128 at most. R and A are decoded
+    # as by open(), i.e. they must be in the main subgroup, and S must be
+    # reduced, so a batch accepts exactly what open() accepts. If the batch fails, each item
+    # is checked with open() to find the bad ones
+    ok = len(items) * [False]
+    pts, ns = [], []
+    keys = {} # vk -> index into pts, the A of a feed is decoded only once
+    s = 0
+    for i, (vk, sig, msg) in enumerate(items):
+        try:
+            assert len(vk) == 32 and len(sig) == 64
+            R = bytes_to_element(sig[:32])
+            S = bytes_to_scalar(sig[32:])
+            assert S < L # as in open()
+            if not vk in keys: # only record a key that could be decoded
+                A = key_fct(vk)[0]
+                keys[vk] = len(pts)
+                pts.append(A.XYTZ)
+                ns.append(0)
+        except Exception as e:
+            # same outcomes as open(): bad encodings or points
+            if isinstance(e, (ValueError, AssertionError)) or \
+               str(e) == "decoding point that is not on curve":
+                continue
+            raise
+        z = int.from_bytes(os.urandom(16), 'little') | 1
+        h = Hint(bytes(sig[:32]) + vk + msg)
+        ns[keys[vk]] = (ns[keys[vk]] + z * h) % L
+        s = (s + z * S) % L
+        pts.append(R.XYTZ)
+        ns.append(z)
+        ok[i] = True
+    if sum(ok) == 0:
+        return ok
+    v = add_elements(multiscalarmult_elements(pts, ns),
+                     scalarmult_base((L - s) % L)) # fixed-base table for B
+    if is_extended_zero(v):
+        return ok
+    for i, (vk, sig, msg) in enumerate(items): # find the bad ones
+        if ok[i]:
+            try:
+                open(bytes(sig) + bytes(msg), vk, key_fct)
+            except BadSignatureError:
+                ok[i] = False
+    return ok
+
 # ed25519_oop.py ------------------------------------------------------------
 
 # import os
@@ -70,16 +70,17 @@ def xform_extended_to_affine(pt):
 
 def double_element(pt): # extended->extended
     # dbl-2008-hwcd
+    # (sums of reduced values are not reduced again: the products are)
     (X1, Y1, Z1, _) = pt
     A = (X1*X1) % Q
     B = (Y1*Y1) % Q
     C = (2*Z1*Z1) % Q
-    D = (-A) % Q
-    J = (X1+Y1) % Q
+    D = -A
+    J = X1+Y1
     E = (J*J-A-B) % Q
-    G = (D+B) % Q
-    F = (G-C) % Q
-    H = (D-B) % Q
+    G = D+B
+    F = G-C
+    H = D-B
     X3 = (E*F) % Q
     Y3 = (G*H) % Q
     Z3 = (F*G) % Q
@@ -188,6 +189,165 @@ def scalarmult_element(pt, n):
             v = _add_elements_nonunfied(v, pt)
     return v
 
+def multiscalarmult_elements(pts, ns): # extended->extended, sum of n*pt
+    # Straus' method: one shared sequence of doublings for all points.
+    # Uses the unified addition, as partial sums may hit any point
+    assert min(ns) >= 0
+    v = xform_affine_to_extended((0,1))
+    for i in range(max(n.bit_length() for n in ns) - 1, -1, -1):
+        v = double_element(v)
+        for pt, n in zip(pts, ns):
+            if (n >> i) & 1:
+                v = add_elements(v, pt)
+    return v
+
+# fixed-base table: _base_table[i][j-1] = j * 16^i * B, for the 64 digits
+# of a radix-16 scalar. n*B then takes at most 64 additions and no
+# doublings. The table (960 points) is built on first use, within ~30ms.
+# Its points are affine and kept as (y-x, y+x, 2*d*x*y), which saves two
+# multiplications per addition (madd-2008-hwcd-3, unified)
+
+_base_table = None
+
+def _to_precomputed(pts): # extended->precomputed, one shared inversion
+    acc = [1]
+    for (_, _, Z, _) in pts:
+        acc.append((acc[-1] * Z) % Q)
+    zi = inv(acc[-1])
+    out = len(pts) * [None]
+    for k in range(len(pts) - 1, -1, -1):
+        (X, Y, Z, _) = pts[k]
+        iz = (zi * acc[k]) % Q # 1/Z
+        zi = (zi * Z) % Q
+        x, y = (X * iz) % Q, (Y * iz) % Q
+        out[k] = ((y - x) % Q, (y + x) % Q, (2 * d * x * y) % Q)
+    return out
+
+def _get_base_table():
+    global _base_table
+    if _base_table == None:
+        pts = []
+        P = xform_affine_to_extended(B)
+        for i in range(64):
+            row = [P]
+            for j in range(14):
+                row.append(add_elements(row[-1], P))
+            pts += row
+            P = double_element(row[7]) # 16 * P
+        pc = _to_precomputed(pts)
+        _base_table = [pc[15*i:15*i+15] for i in range(64)]
+    return _base_table
+
+def _add_precomputed(pt, pc): # extended + precomputed -> extended
+    (X1, Y1, Z1, T1) = pt
+    (ymx, ypx, t2d) = pc
+    A = ((Y1-X1) * ymx) % Q
+    B = ((Y1+X1) * ypx) % Q
+    C = (T1 * t2d) % Q
+    D = (2 * Z1) % Q
+    E = B - A
+    F = D - C
+    G = D + C
+    H = B + A
+    return ((E*F) % Q, (G*H) % Q, (F*G) % Q, (E*H) % Q)
+
+def scalarmult_base(n): # ->extended, n*B for 0 <= n < 2^256
+    assert 0 <= n < 2**256
+    tbl = _get_base_table()
+    v = xform_affine_to_extended((0,1))
+    i = 0
+    while n > 0:
+        if n & 15:
+            v = _add_precomputed(v, tbl[i][(n & 15) - 1])
+        n >>= 4
+        i += 1
+    return v
+
+# double-scalar multiplication a*B + b*P (Straus/Shamir): both scalars are
+# recoded as width-w NAFs and share one pass of doublings. The odd
+# multiples of B are precomputed once and affine, those of P are computed
+# for each call and kept as (Y-X, Y+X, 2*Z, 2*d*T) to avoid an inversion.
+# Runs in variable time, for verifying signatures only (public inputs)
+
+W_BASE = 7 # NAF width for B: 32 precomputed odd multiples
+W_VAR = 5  # NAF width for P: 8 odd multiples per call
+
+_base_odd = None
+
+def _wnaf(n, w): # digits, least significant first, 0 or odd in +-2^(w-1)
+    digits = []
+    while n > 0:
+        k = 0
+        if n & 1:
+            k = n & ((1 << w) - 1)
+            if k >= 1 << (w-1):
+                k -= 1 << w
+            n -= k
+        digits.append(k)
+        n >>= 1
+    return digits
+
+def _to_cached(pt): # extended->cached
+    (X, Y, Z, T) = pt
+    return ((Y-X) % Q, (Y+X) % Q, (2*Z) % Q, (2*d*T) % Q)
+
+def _add_cached(pt, c): # extended + cached -> extended, add-2008-hwcd-3
+    (X1, Y1, Z1, T1) = pt
+    (ymx, ypx, z2, t2d) = c
+    A = ((Y1-X1) * ymx) % Q
+    B = ((Y1+X1) * ypx) % Q
+    C = (T1 * t2d) % Q
+    D = (Z1 * z2) % Q
+    E = B - A
+    F = D - C
+    G = D + C
+    H = B + A
+    return ((E*F) % Q, (G*H) % Q, (F*G) % Q, (E*H) % Q)
+
+def odd_multiples_vartime(pt): # ->cached, for double_scalarmult_vartime()
+    return _odd_multiples(pt, 1 << (W_VAR-2))
+
+def _odd_multiples(pt, cnt): # extended->cached, pt, 3*pt, 5*pt, ..
+    pt2 = _to_cached(double_element(pt))
+    out = [_to_cached(pt)]
+    for k in range(cnt - 1):
+        pt = _add_cached(pt, pt2)
+        out.append(_to_cached(pt))
+    return out
+
+def double_scalarmult_vartime(a, pt, b, pt_odd=None): # ->extended, a*B+b*pt
+    # pt_odd: odd_multiples_vartime(pt), if the caller keeps them
+    global _base_odd
+    assert a >= 0 and b >= 0
+    if _base_odd == None:
+        p = xform_affine_to_extended(B)
+        p2 = double_element(p)
+        pts = [p]
+        for k in range((1 << (W_BASE-2)) - 1):
+            pts.append(add_elements(pts[-1], p2))
+        _base_odd = _to_precomputed(pts)
+    if pt_odd == None:
+        pt_odd = odd_multiples_vartime(pt)
+    na, nb = _wnaf(a, W_BASE), _wnaf(b, W_VAR)
+    v = xform_affine_to_extended((0,1))
+    for i in range(max(len(na), len(nb)) - 1, -1, -1):
+        v = double_element(v)
+        if i < len(na) and na[i] != 0:
+            k = na[i]
+            if k > 0:
+                v = _add_precomputed(v, _base_odd[k >> 1])
+            else: # -(x,y) = (-x,y): swap y-x and y+x, negate 2dxy
+                (ymx, ypx, t2d) = _base_odd[-k >> 1]
+                v = _add_precomputed(v, (ypx, ymx, Q - t2d))
+        if i < len(nb) and nb[i] != 0:
+            k = nb[i]
+            if k > 0:
+                v = _add_cached(v, pt_odd[k >> 1])
+            else:
+                (ymx, ypx, z2, t2d) = pt_odd[-k >> 1]
+                v = _add_cached(v, (ypx, ymx, z2, Q - t2d))
+    return v
+
 # points are encoded as 32-bytes little-endian, b255 is sign, b2b1b0 are 0
 
 def encodepoint(P):
@@ -333,6 +493,17 @@ class Element(ElementOfUnknownGroup):
     def subtract(self, other):
         return self.add(other.negate())
 
+class _BaseElement(Element):
+    # the generator, multiplied with the fixed-base table
+
+    def scalarmult(self, s):
+        if isinstance(s, ElementOfUnknownGroup):
+            raise TypeError("elements cannot be multiplied together")
+        s = s % L
+        if s == 0:
+            return Zero
+        return Element(scalarmult_base(s))
+
 class _ZeroElement(ElementOfUnknownGroup):
     def add(self, other):
         return other # zero+anything = anything
@@ -344,7 +515,7 @@ class _ZeroElement(ElementOfUnknownGroup):
         return self.add(other.negate())
 
 
-Base = Element(xform_affine_to_extended(B))
+Base = _BaseElement(xform_affine_to_extended(B))
 Zero = _ZeroElement(xform_affine_to_extended((0,1))) # the neutral (identity) element
 
 _zero_bytes = Zero.to_bytes()
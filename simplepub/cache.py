@@ -0,0 +1,207 @@
+#
+
+# simplepub/cache.py  -- resources shared by the replicas of a node
+
+import collections
+import os
+
+
+class FilePool:
+    # LRU pool of open (unbuffered, read/write) file handles. A node hands
+    # the same pool to all its replicas so that hot feeds keep their
+    # descriptors while the total stays below the process' fd limit.
+
+    def __init__(self, size=256):
+        self.size = max(size, 2) # a replica may use log and index together
+        self.files = collections.OrderedDict() # fname -> file object
+        self.opened = 0
+        self.hits = 0
+
+    def get(self, fname):
+        f = self.files.get(fname)
+        if f != None:
+            self.files.move_to_end(fname)
+            self.hits += 1
+            return f
+        while len(self.files) >= self.size:
+            self.files.popitem(last=False)[1].close()
+        f = open(fname, 'r+b', buffering=0)
+        self.files[fname] = f
+        self.opened += 1
+        return f
+
+    def fileno(self, fname):
+        return self.get(fname).fileno()
+
+    def release(self, fname): # before truncating, renaming or removing
+        f = self.files.pop(fname, None)
+        if f != None:
+            f.close()
+
+    def close(self):
+        while len(self.files) > 0:
+            self.files.popitem()[1].close()
+
+
+class ContentCache:
+    # byte-budgeted LRU cache of reassembled sidechain contents, keyed by
+    # (fid,seq). Only complete chains are cached: their content can't change
+    # anymore unless the log is truncated, see drop_feed()
+
+    def __init__(self, max_bytes=4*1024*1024):
+        self.max_bytes = max_bytes
+        self.items = collections.OrderedDict() # (fid,seq) -> bytes
+        self.feeds = {} # fid -> set of cached seqs
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fid, seq):
+        c = self.items.get((fid,seq))
+        if c == None:
+            self.misses += 1
+            return None
+        self.items.move_to_end((fid,seq))
+        self.hits += 1
+        return c
+
+    def put(self, fid, seq, content):
+        if len(content) > self.max_bytes or (fid,seq) in self.items:
+            return
+        self.items[(fid,seq)] = content
+        self.feeds.setdefault(fid, set()).add(seq)
+        self.size += len(content)
+        while self.size > self.max_bytes:
+            (f,s), c = self.items.popitem(last=False)
+            self._forget(f, s, c)
+
+    def drop_feed(self, fid, from_seq=1): # after truncating a log
+        for s in [s for s in self.feeds.get(fid, []) if s >= from_seq]:
+            self._forget(fid, s, self.items.pop((fid,s)))
+
+    def _forget(self, fid, seq, content):
+        self.size -= len(content)
+        self.feeds[fid].discard(seq)
+        if len(self.feeds[fid]) == 0:
+            del self.feeds[fid]
+
+    def get_stats(self):
+        return {'items': len(self.items), 'bytes': self.size,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class ChainBudget:
+    # byte budgets for the sidechain space reserved by pending (incomplete)
+    # chains: per entry, per feed and per node, None means no limit. A chain
+    # that does not fit is dropped: its entry is stored without sidechain
+    # and the chain is never fetched, also not when space frees up later
+
+    def __init__(self, entry_max=None, feed_max=None, node_max=None):
+        self.entry_max = entry_max
+        self.feed_max = feed_max
+        self.node_max = node_max
+        self.feeds = {} # fid -> bytes reserved for pending chains
+        self.used = 0
+        self.dropped = 0
+
+    def set_feed(self, fid, nbytes): # after (re)loading a replica
+        self.used += nbytes - self.feeds.get(fid, 0)
+        self.feeds[fid] = nbytes
+
+    def reserve(self, fid, nbytes): # True/False
+        fb = self.feeds.get(fid, 0)
+        if (self.entry_max != None and nbytes > self.entry_max) or \
+           (self.feed_max != None and fb + nbytes > self.feed_max) or \
+           (self.node_max != None and self.used + nbytes > self.node_max):
+            self.dropped += 1
+            return False
+        self.feeds[fid] = fb + nbytes
+        self.used += nbytes
+        return True
+
+    def release(self, fid, nbytes): # chunks were received
+        self.feeds[fid] -= nbytes
+        self.used -= nbytes
+
+    def get_stats(self):
+        return {'used': self.used, 'node_max': self.node_max,
+                'feed_max': self.feed_max, 'entry_max': self.entry_max,
+                'feeds': len([b for b in self.feeds.values() if b > 0]),
+                'dropped': self.dropped}
+
+class ChunkIndex:
+    # maps the hash of a chunk (its 20B pointer) to where it is stored, as
+    # (fid, seq, cnr, pos), and counts the places storing the same chunk.
+    # Records are appended to a file and loaded at startup. A chunk may have
+    # disappeared since (truncated log): callers check the hash of what they
+    # read and remove() stale entries
+
+    REC_LEN = 68 # hptr, fid, seq (4B), cnr (4B), pos (8B)
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.items = {} # hptr -> (fid, seq, cnr, pos)
+        self.refs = {}  # hptr -> nr of places, for chunks stored twice or more
+        self.dups = 0   # nr of chunks also found at another place
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(fname, 'rb') as f:
+                buf = f.read()
+        except FileNotFoundError:
+            buf = b''
+        n = len(buf) // self.REC_LEN
+        if n * self.REC_LEN != len(buf): # partially written record
+            os.truncate(fname, n * self.REC_LEN)
+        for i in range(0, n * self.REC_LEN, self.REC_LEN):
+            self._insert(buf[i:i+20], buf[i+20:i+52],
+                         int.from_bytes(buf[i+52:i+56], 'big'),
+                         int.from_bytes(buf[i+56:i+60], 'big'),
+                         int.from_bytes(buf[i+60:i+68], 'big'))
+        self.f = open(fname, 'ab')
+
+    def _insert(self, hptr, fid, seq, cnr, pos): # True if a new place
+        loc = self.items.get(hptr, None)
+        if loc != None:
+            if loc[:3] == (fid, seq, cnr):
+                return False
+            self.refs[hptr] = self.refs.get(hptr, 1) + 1
+            self.dups += 1
+            return True
+        self.items[hptr] = (fid, seq, cnr, pos)
+        return True
+
+    def add(self, hptr, fid, seq, cnr, pos):
+        if self._insert(hptr, fid, seq, cnr, pos):
+            self.f.write(hptr + fid + seq.to_bytes(4, 'big') +
+                         cnr.to_bytes(4, 'big') + pos.to_bytes(8, 'big'))
+
+    def get(self, hptr): # (fid, seq, cnr, pos) or None
+        loc = self.items.get(hptr, None)
+        if loc == None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return loc
+
+    def get_refs(self, hptr): # nr of places where the chunk is stored
+        if not hptr in self.items:
+            return 0
+        return self.refs.get(hptr, 1)
+
+    def remove(self, hptr): # stale entry, the record stays in the file
+        self.items.pop(hptr, None)
+        if self.refs.get(hptr, 0) > 0:
+            self.dups -= self.refs.pop(hptr) - 1
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+    def get_stats(self):
+        return {'chunks': len(self.items), 'dups': self.dups,
+                'hits': self.hits, 'misses': self.misses}
+
+# eof
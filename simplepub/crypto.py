@@ -0,0 +1,182 @@
+#
+
+# simplepub/crypto.py  -- Ed25519 signature backends for a node
+
+import collections
+
+import pure25519
+
+'''
+A backend verifies (and, for authors and tests, makes) Ed25519 signatures:
+
+  verify(pk, sig, msg) -> True/False
+  verify_batch([(pk, sig, msg), ...]) -> [True/False, ...]
+  sign(msg, skvk) -> 64B signature, skvk is seed+vk as from pure25519
+  get_stats() -> dict
+
+Native implementations are used if their Python package is installed, in
+the order of BACKENDS, with pure25519 as the fallback. At startup, a node
+runs selftest() and only picks a backend that agrees with pure25519.
+'''
+
+
+class Pure25519:
+    # pure Python. Decoding a public key costs about as much as the rest of
+    # a verification, so the decoded keys of the most recently used feeds
+    # (point and its odd multiples for the h*A step) are kept in a bounded
+    # LRU cache, about 2.5KB per key
+
+    name = 'pure25519'
+
+    def __init__(self, max_keys=4096):
+        self.max_keys = max_keys
+        self.keys = collections.OrderedDict() # vk -> (A, odd multiples)
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, vk): # raises as pure25519.decode_key() for a bad vk
+        k = self.keys.get(vk)
+        if k != None:
+            self.keys.move_to_end(vk)
+            self.hits += 1
+            return k
+        self.misses += 1
+        k = pure25519.decode_key(vk)
+        self.keys[vk] = k
+        while len(self.keys) > self.max_keys:
+            self.keys.popitem(last=False)
+        return k
+
+    def verify(self, pk, sig, msg): # True/False
+        try:
+            pure25519.open(sig+msg, pk, self._key)
+            return True
+        except pure25519.BadSignatureError:
+            return False
+
+    def verify_batch(self, items): # [(pk, sig, msg)] -> [True/False]
+        return pure25519.verify_batch(items, self._key)
+
+    def sign(self, msg, skvk):
+        return pure25519.sign(msg, skvk)[:64]
+
+    def get_stats(self):
+        return {'backend': self.name, 'keys': len(self.keys),
+                'hits': self.hits, 'misses': self.misses}
+
+
+class PyNaCl:
+    # libsodium, via the PyNaCl package
+
+    name = 'nacl'
+
+    def __init__(self):
+        import nacl.exceptions
+        import nacl.signing
+        self.signing = nacl.signing
+        self.bad_sig = nacl.exceptions.BadSignatureError
+
+    def verify(self, pk, sig, msg):
+        try:
+            self.signing.VerifyKey(bytes(pk)).verify(bytes(msg), bytes(sig))
+            return True
+        except (self.bad_sig, ValueError):
+            return False
+
+    def verify_batch(self, items):
+        return [self.verify(pk, sig, msg) for pk, sig, msg in items]
+
+    def sign(self, msg, skvk):
+        return self.signing.SigningKey(bytes(skvk[:32])).sign(msg).signature
+
+    def get_stats(self):
+        return {'backend': self.name}
+
+
+class Cryptography:
+    # OpenSSL, via the cryptography package
+
+    name = 'cryptography'
+
+    def __init__(self):
+        from cryptography.exceptions import InvalidSignature
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+        self.ed25519 = ed25519
+        self.bad_sig = InvalidSignature
+
+    def verify(self, pk, sig, msg):
+        try:
+            self.ed25519.Ed25519PublicKey.from_public_bytes(bytes(pk)).verify(
+                                                        bytes(sig), bytes(msg))
+            return True
+        except (self.bad_sig, ValueError):
+            return False
+
+    def verify_batch(self, items):
+        return [self.verify(pk, sig, msg) for pk, sig, msg in items]
+
+    def sign(self, msg, skvk):
+        return self.ed25519.Ed25519PrivateKey.from_private_bytes(
+                                                bytes(skvk[:32])).sign(msg)
+
+    def get_stats(self):
+        return {'backend': self.name}
+
+
+BACKENDS = collections.OrderedDict([ # most preferred first
+    ('nacl', PyNaCl),
+    ('cryptography', Cryptography),
+    ('pure25519', Pure25519)])
+
+def load(name): # backend instance, or None if its package is missing
+    try:
+        return BACKENDS[name]()
+    except ImportError:
+        return None
+
+def selftest(backends): # [names of the backends agreeing with pure25519]
+    # RFC 8032 test vectors 1 and 2, signatures made by each backend, and
+    # altered messages and signatures, incl. S+L which RFC 8032 rejects:
+    # all must give the same verdicts
+    ref = Pure25519()
+    tests = []
+    for seed, msg, sig in [
+        ('9d61b19deffd5a60ba844af492ec2cc44449c5697b326919703bac031cae7f60',
+         '', 'e5564300c360ac729086e2cc806e828a84877f1eb8e5d974d873e065224901'
+         '555fb8821590a33bacc61e39701cf9b46bd25bf5f0595bbe24655141438e7a100b'),
+        ('4ccd089b28ff96da9db6c346ec114e0f5b8a319f35aba624da8cf6ed4fb8a6fb',
+         '72', '92a009a9f0d4cab8720e820b5f642540a2b27b5416503f8fb3762223ebdb'
+         '69da085ac1e43e15996e458f3613d0f11d8c387b2eaeb4302aeeb00d291612bb0c00')]:
+        vk, skvk = pure25519.publickey(bytes.fromhex(seed))
+        msg, sig = bytes.fromhex(msg), bytes.fromhex(sig)
+        S = int.from_bytes(sig[32:], 'little') + pure25519.L
+        tests += [(vk, sig, msg), (vk, sig, msg + b'x'),
+                  (vk, sig[:32] + bytes(32), msg),
+                  (vk, bytes(32) + sig[32:], msg),
+                  (vk, sig[:32] + S.to_bytes(32, 'little'), msg)]
+    msg = b'tinyssb selftest' + bytes(100)
+    ok = []
+    for b in backends:
+        try:
+            sig = b.sign(msg, skvk)
+            assert sig == ref.sign(msg, skvk), 'other signature' # Ed25519
+            # signatures are deterministic
+            t = tests + [(vk, sig, msg), (vk, sig[:-1] + b'\x00', msg)]
+            assert [b.verify(*x) for x in t] == \
+                   [ref.verify(*x) for x in t] == b.verify_batch(t), \
+                   'other verdicts'
+            ok.append(b.name)
+        except Exception as e:
+            print(f"  signature backend '{b.name}' failed the selftest:",
+                  type(e).__name__, e)
+    return ok
+
+def get_backend(name=None): # name=None: the first usable one of BACKENDS
+    backends = [load(n) for n in (BACKENDS if name == None else [name])]
+    backends = [b for b in backends if b != None]
+    ok = selftest(backends)
+    if name != None and not name in ok:
+        raise ValueError(f"signature backend '{name}' is not usable")
+    return [b for b in backends if b.name == ok[0]][0]
+
+# eof
@@ -2,15 +2,18 @@
 
 # simplepub/node.py
 
-import copy
+import collections
+import concurrent.futures
 import hashlib
 import os
 import time
 import traceback
 
-import pure25519
 from . import bipf
+from . import cache
+from . import crypto
 from . import goset
+from . import pack
 from . import replica
 
 DMX_LEN = 7
@@ -18,16 +21,79 @@ DMX_PFX = b'tinyssb-v0'
 
 class PubNode:
 
-    def __init__(self, datapath, role='in', verbose=False):
+    def __init__(self, datapath, role='in', verbose=False, use_mmap=False,
+                 max_files=256, commit_every=1, commit_interval=1.0,
+                 entry_batch=32, cache_bytes=4*1024*1024, load_workers=None,
+                 lazy=0, idle_timeout=60, stage_max=256,
+                 chain_max=None, feed_pend_max=None,
+                 node_pend_max=None, durability='none',
+                 backend=None, chunk_index=False, sig_backend=None):
         self.start_time = time.time()
         print(f"Simplepub for directory {datapath}, role is '{role}'")
         self.datapath = datapath
         self.role = role
         self.verbose = verbose
-        self.vf = lambda pk,sig,msg: pure25519.open(sig+msg,pk)
-        self.reps  = { fid: replica.Replica(datapath,fid,self.vf) for fid in [
-                    bytes.fromhex(fn) for fn in os.listdir(datapath)
-                    if len(fn) == 64 and os.path.isdir(datapath + '/' + fn)] }
+        self.use_mmap = use_mmap # responders hand out memoryviews, no copies
+        self.fpool = cache.FilePool(max_files) # open log/index files
+        self.ccache = cache.ContentCache(cache_bytes) # sidechain contents
+        self.budget = cache.ChainBudget(chain_max, feed_pend_max, # space for
+                                        node_pend_max)    # pending chains
+        self.commit_every = commit_every       # frontier group commit:
+        self.commit_interval = commit_interval # flush every N updates or T sec
+        self.last_commit = time.time()
+        self.durability = durability # 'interval': fsync on the above flush
+        self.dirty = set() # fids of replicas with unsaved frontier updates
+        self.entry_batch = entry_batch # max nr of entries to buffer per feed
+        self.ebuf = {}     # fid -> [first_seq, [pkts], prev]
+        self.stage_max = stage_max # max nr of chunks waiting for predecessor
+        self.stage = collections.OrderedDict() # hptr -> early chunk pkt
+        self.verifier = crypto.get_backend(sig_backend) # after a selftest
+        print(f"  signature backend is '{self.verifier.name}'")
+        self.vf = lambda pk,sig,msg: self.verifier.verify(pk,sig,msg)
+        self.vbf = lambda items: self.verifier.verify_batch(items) # runs
+        self.cindex = None # chunk hash -> (fid,seq,cnr,pos), if enabled
+        self.local_chunks = 0 # chunks copied from other chains, not fetched
+        if chunk_index:
+            self.cindex = cache.ChunkIndex(datapath + '/chunks.idx')
+        self.lazy = lazy # if >0: max nr of open replicas, others on demand
+        self.idle_timeout = idle_timeout # sec, before closing a replica
+        self.summ_fname = datapath + '/summary.bin'
+        self.summ = {}   # closed replicas: fid -> [max_seq,max_pos,prev,#pend,
+                         #   last segment nr, its start, pending chain bytes]
+        self.last_use = {} # fid -> timestamp
+        t0 = time.time()
+        if backend == None: # use the packfile backend if there is one
+            backend = 'pack' if os.path.isdir(datapath+'/pack') else '2fpf'
+        print(f"  storage backend is '{backend}'")
+        self.store = None # 2FPF: one directory per feed, else a PackStore
+        if backend == 'pack':
+            self.store = pack.PackStore(datapath, self.fpool, durability,
+                                        use_mmap)
+            fids = list(self.store.feeds.keys())
+        else:
+            fids = [ bytes.fromhex(fn) for fn in os.listdir(datapath)
+                     if len(fn) == 64 and os.path.isdir(datapath + '/' + fn)]
+        if lazy:
+            self._load_summaries(fids)
+        t1 = time.time()
+        self.reps = collections.OrderedDict() # open replicas, in LRU order
+        if self.store != None: # frontiers are in memory already
+            loaded = [self._load_replica(fid) for fid in fids
+                      if not fid in self.summ]
+        else:
+            # load and recover the replicas in parallel, this is mostly I/O
+            with concurrent.futures.ThreadPoolExecutor(load_workers) as ex:
+                loaded = list(ex.map(self._load_replica,
+                                [fid for fid in fids if not fid in self.summ]))
+            for rep, _, _ in loaded:
+                rep.fpool.close() # from now on use the node's shared resources
+                rep.fpool, rep.ccache, rep.budget = self.fpool, self.ccache, \
+                                                    self.budget
+                self.budget.set_feed(rep.fid, rep.get_pending_bytes())
+        for rep, _, _ in loaded:
+            self.reps[rep.fid] = rep
+            self.last_use[rep.fid] = t1
+        t2 = time.time()
         self.chkt  = {}    # chunk filter bank
         self.dmxt  = {}    # DMX filter bank
         self.in_entry = lambda dmx, buf: self.incoming_entry(dmx, buf)
@@ -36,39 +102,104 @@ class PubNode:
         self.in_chk = lambda dmx, buf: self.incoming_chnk_msg(dmx, buf)
         self.want_dmx = None
         self.chnk_dmx = None
-        self.goset = goset.GOset(self, self.reps.keys(), verbose)
+        self.goset = goset.GOset(self, fids, verbose)
         self.arm_dmx(self.goset.goset_dmx,
                      lambda dmx, buf: self.goset.incoming_goset_msg(dmx, buf),
                      None, 'GOset')
         self.set_want_dmx(self.goset.state)
-        if len(self.reps) == 0:
+        if len(fids) == 0:
             self.log_offs = 0
         else:
-            self.log_offs = os.urandom(1)[0] % len(self.reps)
+            self.log_offs = os.urandom(1)[0] % len(fids)
         if self.verbose:
             print("gset dmx", self.goset.goset_dmx.hex())
             print("want dmx", '-' if self.want_dmx == None else self.want_dmx.hex())
             print("chnk dmx", '-' if self.chnk_dmx == None else self.chnk_dmx.hex())
         if role != 'out': # 'in' or 'inout': listen to req
-            for ndx in range(len(self.goset.keys)):
-                fid = self.goset.keys[ndx]
-                seq = self.reps[fid].state['max_seq'] + 1
-                nam = fid + seq.to_bytes(4, 'big') + self.reps[fid].state['prev']
-                dmx = self.compute_dmx(nam)
-                self.arm_dmx(dmx, self.in_entry, (fid, seq), f"{ndx}.{seq}")
-                for seq,p in self.reps[fid].state['pend_sc'].items():
-                    # print(p)
-                    cnr = p[0]
-                    self.arm_chk(p[2], self.in_chunk, (fid,seq,cnr), f"{ndx}.{seq}.{cnr}")
+            for rep, dmx, chks in loaded:
+                ndx = self.goset._key_to_ndx(rep.fid)
+                seq = rep.state['max_seq'] + 1
+                self.arm_dmx(dmx, self.in_entry, (rep.fid, seq), f"{ndx}.{seq}")
+                for seq,cnr,hptr in chks:
+                    self.arm_chk(hptr, self.in_chunk, (rep.fid,seq,cnr),
+                                 f"{ndx}.{seq}.{cnr}")
+            for fid in self.summ:
+                self._arm_next_entry(fid)
+        if lazy:
+            self._evict_replicas(t2)
+        t3 = time.time()
+        print(f"  startup: {len(fids)} feeds, scan {t1-t0:.3f}s, " +
+              f"load {t2-t1:.3f}s, arm {t3-t2:.3f}s")
         # print(f"len of chkt is {len(self.chkt)}")
         self.rtt = 4          # sec
         self.last_e_adv = 0   # timestamp
         self.incoming_cnt = 0 # either entry or chunk
                 
 
+    def tick(self, force=False): # called periodically by the I/O loop
+        self.flush_entries()
+        now = time.time()
+        if not force and now - self.last_commit < self.commit_interval:
+            return
+        for fid in self.dirty:
+            self.reps[fid].flush()
+        self.dirty.clear()
+        if self.store != None:
+            self.store.commit()
+        if self.cindex != None:
+            self.cindex.flush()
+        self.last_commit = now
+        if self.lazy:
+            self._evict_replicas(now)
+
+    def close(self):
+        self.tick(force=True)
+        summ = dict(self.summ)
+        for fid, rep in self.reps.items():
+            summ[fid] = self._summarize(rep)
+        with open(self.summ_fname + '.tmp', 'wb') as f:
+            f.write(bipf.dumps(summ))
+        os.replace(self.summ_fname + '.tmp', self.summ_fname)
+        if self.store != None:
+            self.store.close()
+        if self.cindex != None:
+            self.cindex.close()
+        self.fpool.close()
+        print(f"  stats: {self.get_stats()}")
+
+    def get_stats(self):
+        return {'feeds': len(self.reps) + len(self.summ),
+                'open': len(self.reps), 'staged': len(self.stage),
+                'files': {'open': len(self.fpool.files),
+                          'opened': self.fpool.opened,
+                          'hits': self.fpool.hits},
+                'cache': self.ccache.get_stats(),
+                'budget': self.budget.get_stats(),
+                'crypto': self.verifier.get_stats(),
+                'chunks': None if self.cindex == None else
+                          self.cindex.get_stats(),
+                'dedup': {'local_chunks': self.local_chunks,
+                          'traffic_saved': 120 * self.local_chunks,
+                          'disk_dup': 0 if self.cindex == None else
+                                      120 * self.cindex.dups}}
+
+    def get_chunk_by_hash(self, hptr): # chunk pkt or None, needs chunk_index
+        loc = None if self.cindex == None else self.cindex.get(hptr)
+        if loc == None:
+            return None
+        fid, seq, cnr, pos = loc
+        chunk = None
+        if fid in self.reps or fid in self.summ:
+            chunk = self._replica(fid).get_chunk_at(pos)
+        if chunk == None or hashlib.sha256(chunk).digest()[:20] != hptr:
+            self.cindex.remove(hptr)
+            return None
+        return chunk
+
     def get_entry_adv(self):
         if self.role == 'out':
             return [],4 # don't request stuff
+        self.flush_entries()
         if self.incoming_cnt == 0:
             self.rtt *= 1.5
             if self.rtt > 4.0:
@@ -83,7 +214,7 @@ class PubNode:
         for i in range(len(self.goset.keys)):
             ndx = (self.log_offs + i) % len(self.goset.keys)
             fid = self.goset.keys[ndx]
-            seq = self.reps[fid].state['max_seq'] + 1
+            seq = self._frontier(fid)[0] + 1
             lst.append(seq)
             enc_len += bipf.encodingLength(seq)
             if enc_len > 100:
@@ -102,7 +233,7 @@ class PubNode:
         enc_len = 0
         for i in range(len(self.goset.keys)):
             ndx = (self.log_offs + i) % len(self.goset.keys)
-            pend = self.reps[self.goset.keys[ndx]].state['pend_sc']
+            pend = self._pending_chains(self.goset.keys[ndx])
             for s,p in pend.items():
                 t = [ndx,s,p[0]]
                 lst.append(t)
@@ -122,7 +253,8 @@ class PubNode:
         # print(f"<< incoming {pkt[:20].hex()}.. ({len(pkt)}B)")
         lst = []
         dmx = pkt[:7] # DMX_LEN = 7
-        if dmx in self.dmxt:
+        known = dmx in self.dmxt
+        if known:
             # if not dmx in [self.want_dmx,self.chnk_dmx,self.goset.goset_dmx]:
             #     print("  ", dmx.hex(), self.dmxt[dmx])
             lst += self.dmxt[dmx][0](dmx, pkt)
@@ -131,19 +263,127 @@ class PubNode:
             plst = [x for x in self.chkt[hptr].items()]
             for a,v in plst:
                 lst += v[0](hptr, a, pkt)
+        elif not known and len(pkt) == 120:
+            # could be a chunk that arrived before its predecessor
+            self.stage[hptr] = pkt
+            self.stage.move_to_end(hptr)
+            if len(self.stage) > self.stage_max:
+                self.stage.popitem(last=False)
         # print("to send:", [x[:30].hex() for x in lst])
         return lst
 
     # -----------------------------------------------------------------
 
+    def _load_replica(self, fid): # (replica, entry dmx, [(seq,cnr,hptr)])
+        if self.store != None:
+            rep = self._new_replica(fid)
+        else:
+            # runs in a worker thread: use a private file pool, no cache, and
+            # a private budget (the node limit is not enforced in recovery)
+            b = cache.ChainBudget(self.budget.entry_max, self.budget.feed_max)
+            rep = replica.Replica(self.datapath, fid, self.vf,
+                                  use_mmap=self.use_mmap,
+                                  commit_every=self.commit_every, budget=b,
+                                  durability=self.durability,
+                                  verify_batch_fct=self.vbf)
+        seq = rep.state['max_seq'] + 1
+        dmx = self.compute_dmx(fid + seq.to_bytes(4, 'big') + rep.state['prev'])
+        return rep, dmx, [(s,p[0],p[2]) for s,p in rep.state['pend_sc'].items()]
+
+    def _new_replica(self, fid):
+        if self.store != None:
+            return pack.PackReplica(self.store, fid, self.vf,
+                                    ccache=self.ccache, budget=self.budget,
+                                    commit_every=self.commit_every,
+                                    verify_batch_fct=self.vbf)
+        return replica.Replica(self.datapath, fid, self.vf,
+                               use_mmap=self.use_mmap, fpool=self.fpool,
+                               commit_every=self.commit_every,
+                               ccache=self.ccache, budget=self.budget,
+                               durability=self.durability,
+                               verify_batch_fct=self.vbf)
+
+    def _replica(self, fid): # the feed's replica, opened on demand
+        rep = self.reps.get(fid, None)
+        if rep == None:
+            rep = self._new_replica(fid)
+            del self.summ[fid]
+            self.reps[fid] = rep
+            if self.role != 'out':
+                ndx = self.goset._key_to_ndx(fid)
+                for seq,p in rep.state['pend_sc'].items():
+                    self.arm_chk(p[2], self.in_chunk, (fid,seq,p[0]),
+                                 f"{ndx}.{seq}.{p[0]}")
+        else:
+            self.reps.move_to_end(fid)
+        self.last_use[fid] = time.time()
+        return rep
+
+    def _frontier(self, fid): # (max_seq, prev), without opening the replica
+        rep = self.reps.get(fid, None)
+        if rep != None:
+            return rep.state['max_seq'], rep.state['prev']
+        return self.summ[fid][0], self.summ[fid][2]
+
+    def _pending_chains(self, fid): # {seq:[cnr,rem,hptr,pos]}
+        if fid in self.summ and self.summ[fid][3] == 0:
+            return {}
+        return self._replica(fid).state['pend_sc']
+
+    def _summarize(self, rep):
+        segs = rep.state.get('segs', [0])
+        return [rep.state['max_seq'], rep.state['max_pos'], rep.state['prev'],
+                len(rep.state['pend_sc']), len(segs) - 1, segs[-1],
+                rep.get_pending_bytes()]
+
+    def _load_summaries(self, fids): # only keep those matching the log size
+        try:
+            with open(self.summ_fname, 'rb') as f:
+                summ = bipf.loads(f.read())
+        except Exception:
+            return
+        for fid in fids:
+            if not fid in summ or len(summ[fid]) < 7: # older format: reload
+                continue
+            s = summ[fid] # check the size of the feed's last log segment
+            try:
+                sz = os.path.getsize(replica.seg_fname(self.datapath + '/' +
+                                                       fid.hex() + '/', s[4]))
+                if s[5] + sz == s[1]:
+                    self.summ[fid] = s
+                    self.budget.set_feed(fid, s[6]) # counts while closed
+            except OSError:
+                pass
+
+    def _evict_replicas(self, now): # lazy mode: close LRU and idle replicas
+        while len(self.reps) > 0:
+            fid, rep = next(iter(self.reps.items()))
+            if len(self.reps) <= self.lazy and \
+               now - self.last_use[fid] < self.idle_timeout:
+                break
+            if fid in self.ebuf:
+                self.flush_entries(fid)
+            rep.flush()
+            self.dirty.discard(fid)
+            for seq,p in rep.state['pend_sc'].items():
+                self.arm_chk(p[2], None, (fid,seq,p[0]))
+            self.summ[fid] = self._summarize(rep)
+            del self.reps[fid]
+            del self.last_use[fid]
+
+    def _arm_next_entry(self, fid):
+        seq, prev = self._frontier(fid)
+        seq += 1
+        nam = fid + seq.to_bytes(4, 'big') + prev
+        self.arm_dmx(self.compute_dmx(nam), self.in_entry, (fid, seq),
+                     f"{self.goset._key_to_ndx(fid)}.{seq}")
+
     def activate_feed(self, fid) -> None:
-        if not fid in self.reps:
-            self.reps[fid] = replica.Replica(self.datapath, fid, self.vf)
+        if not fid in self.reps and not fid in self.summ:
+            self.reps[fid] = self._new_replica(fid)
+            self.last_use[fid] = time.time()
             # arm dmx for the activated feed
-            seq = self.reps[fid].state['max_seq'] + 1
-            nam = fid + seq.to_bytes(4, 'big') + self.reps[fid].state['prev']
-            dmx = self.compute_dmx(nam)
-            self.arm_dmx(dmx, self.in_entry, (fid, seq), f"{self.goset._key_to_ndx(fid)}.{seq}")
+            self._arm_next_entry(fid)
 
     def arm_dmx(self, dmx, fct=None, aux=None, comment=None):
         if fct == None:
@@ -208,30 +448,62 @@ class PubNode:
             c = ""
         # for d,c in self.dmxt.items():
         #     print("   - dmxt", d.hex(), c)
-        rc = self.reps[fid].ingest_entry_pkt(buf, seq)
-        if rc: # success
-            if self.verbose:
-                print(f"   ingested new entry dmx={dmx.hex()} {ndx}.{seq}{c}")
-            self.arm_dmx(dmx)
+        if len(buf) != 120: # leave the filter armed for the real entry
+            print(f"   entry {ndx}.{seq} with wrong length {len(buf)}")
+            return []
+        self.arm_dmx(dmx)
+        if not fid in self.ebuf:
+            self.ebuf[fid] = [seq, [], self._frontier(fid)[1]]
+        eb = self.ebuf[fid]
+        # chain the next dmx on the buffered entry, it is validated later.
+        # A forged entry with the right dmx thus makes us miss the real
+        # ones until the next flush, which re-arms from the stored frontier
+        nam = fid + seq.to_bytes(4, 'big') + eb[2]
+        eb[1].append(buf)
+        eb[2] = hashlib.sha256(DMX_PFX + nam + buf).digest()[:20]
+        if self.verbose:
+            print(f"   buffered new entry dmx={dmx.hex()} {ndx}.{seq}{c}")
+        if len(eb[1]) >= self.entry_batch:
+            self.flush_entries(fid)
+        else:
             seq += 1
-            nam = fid + seq.to_bytes(4, 'big') + self.reps[fid].state['prev']
-            dmx = self.compute_dmx(nam)
-            self.arm_dmx(dmx, self.in_entry, (fid, seq),
+            nam = fid + seq.to_bytes(4, 'big') + eb[2]
+            self.arm_dmx(self.compute_dmx(nam), self.in_entry, (fid, seq),
                          f"{ndx}.{seq}")
-            # print(f"   pend_sc: {self.reps[fid].state['pend_sc']}")
-            seq -= 1
-            if seq in self.reps[fid].state['pend_sc']:
-                p = self.reps[fid].state['pend_sc'][seq]
-                cnr = p[0]
-                self.arm_chk(p[2], self.in_chunk, (fid,seq,cnr),
-                             f"{ndx}.{seq}.{cnr}")
-        else:
-            if self.verbose:
-                print(f"   failed to ingest new entry dmx={dmx.hex()} {ndx}.{seq}{c}")
         # for dmx in self.dmxt:
         #     print(f"   dmxt {dmx.hex()} {self.dmxt[dmx][2]}")
         return []
 
+    def flush_entries(self, fid=None): # ingest buffered entries, per feed
+        for fid in list(self.ebuf.keys()) if fid == None else [fid]:
+            first, pkts, prev = self.ebuf.pop(fid)
+            ndx = self.goset._key_to_ndx(fid)
+            cnt = 0
+            try:
+                rep = self._replica(fid)
+                cnt = rep.ingest_entry_pkts(pkts, first)
+                if cnt > 0:
+                    self.dirty.add(fid)
+                    if self.verbose:
+                        print(f"   ingested {cnt} new entries {ndx}.{first}..{first+cnt-1}")
+                if cnt < len(pkts):
+                    if self.verbose:
+                        print(f"   failed to ingest new entry {ndx}.{first+cnt}")
+            finally:
+                # (re-)arm the dmx for the next entry, from the stored
+                # frontier: also if the ingest failed, else the feed stalls
+                seq = first + len(pkts)
+                nam = fid + seq.to_bytes(4, 'big') + prev
+                self.arm_dmx(self.compute_dmx(nam))
+                max_seq, fprev = self._frontier(fid)
+                seq = max_seq + 1
+                nam = fid + seq.to_bytes(4, 'big') + fprev
+                self.arm_dmx(self.compute_dmx(nam), self.in_entry,
+                             (fid, seq), f"{ndx}.{seq}")
+            for seq in range(first, first + cnt):
+                if seq in rep.state['pend_sc']:
+                    self._arm_chain(fid, rep, seq)
+
     def incoming_chunk(self, hptr, aux, buf):
         self.adjust_RTT()
 #        global LAST_C_ADV, RTT, C_REPLY_CNT
@@ -246,17 +518,16 @@ class PubNode:
             c = f" /{self.chkt[hptr][2]}"
         except:
             c = ""
-        rc = self.reps[fid].ingest_chunk_pkt(buf, seq)
+        rep = self._replica(fid)
+        rc = rep.ingest_chunk_pkt(buf, seq)
         if rc: # success
+            self.dirty.add(fid)
             if self.verbose:
 
                 print(f"   ingested new chunk hptr={hptr.hex()} {ndx}.{seq}.{cnr}{c}")
             self.arm_chk(hptr, None, aux)
-            if seq in self.reps[fid].state['pend_sc']:
-                hptr = self.reps[fid].state['pend_sc'][seq][2]
-                cnr += 1
-                self.arm_chk(hptr, self.in_chunk, (fid,seq,cnr), f"{ndx}.{seq}.{cnr}")
-            else:
+            self._arm_chain(fid, rep, seq)
+            if not seq in rep.state['pend_sc']:
                 if self.verbose:
                     print(f"   chain {ndx}.{seq} closed")
         else:
@@ -275,6 +546,46 @@ class PubNode:
 
         return []
 
+    def _arm_chain(self, fid, rep, seq): # listen for the next chunk, but
+        # first write the chunks that continue the chain and are at hand:
+        # staged ones, or chunks already stored for another chain
+        if not seq in rep.state['pend_sc']: # has just been completed
+            self._index_chain(fid, rep, seq)
+            return
+        p = rep.state['pend_sc'][seq]
+        pkts = []
+        local = 0
+        hptr = p[2]
+        while len(pkts) < p[1]:
+            if hptr in self.stage:
+                pkts.append(self.stage.pop(hptr))
+            else:
+                pkt = self.get_chunk_by_hash(hptr)
+                if pkt == None:
+                    break
+                pkts.append(bytes(pkt))
+                local += 1
+            hptr = pkts[-1][-20:]
+        if len(pkts) > 0 and rep.ingest_chunk_pkts(pkts, seq) > 0:
+            self.dirty.add(fid)
+            self.local_chunks += local
+            if self.verbose:
+                print(f"   ingested {len(pkts)} staged or local chunks for {fid[:10].hex()}.{seq}")
+        if seq in rep.state['pend_sc']:
+            p = rep.state['pend_sc'][seq]
+            self.arm_chk(p[2], self.in_chunk, (fid,seq,p[0]),
+                         f"{self.goset._key_to_ndx(fid)}.{seq}.{p[0]}")
+        else:
+            self._index_chain(fid, rep, seq)
+
+    def _index_chain(self, fid, rep, seq): # remember where its chunks are
+        if self.cindex == None:
+            return
+        hptr = bytes(rep.get_entry_pkt(seq)[36:56])
+        for cnr, pos, chunk in rep.iter_chunks(seq):
+            self.cindex.add(hptr, fid, seq, cnr, pos)
+            hptr = bytes(chunk[-20:])
+
     def incoming_want_msg(self, dmx, buf) -> list:
         # print("   incoming WANT")
         want = bipf.loads(buf[DMX_LEN:])
@@ -288,35 +599,47 @@ class PubNode:
         cnt = (len(want)-1) * [0]
         offs = want[0]
         credit = 3
+        avail = (len(want)-1) * [0] # nr of entries we have beyond the want
+        for i in range(len(want)-1):
+            try:
+                fid = self.goset.keys[(offs + i) % len(self.goset.keys)]
+                avail[i] = self._frontier(fid)[0] - want[i+1] + 1
+            except Exception as e:
+                print("   error incoming WANT")
+                traceback.print_exc()
+        share = (len(want)-1) * [0]
         found_something = True
-        while found_something:
+        while found_something: # hand out the credit round-robin
             found_something = False
             for i in range(len(want)-1):
-                try:
-                    ndx = (offs + i) % len(self.goset.keys)
-                    fid = self.goset.keys[ndx]
-                    seq = want[i+1] + cnt[i]
-                    pkt = self.reps[fid].get_entry_pkt(seq)
-                    if pkt != None:
-                        # print(f"   {ndx}.{seq} found")
-                        lst.append(copy.copy(pkt))
-                        cnt[i] += 1
-                        credit -= 1
-                        if credit <= 0:
-                            found_something = False
-                            break
-                        found_something = True
-                except Exception as e:
-                    print("   error incoming WANT")
-                    traceback.print_exc()
-
-        v = "   =W ["
-        for i in range(len(cnt)):
-            ndx = (offs + i) % len(self.goset.keys)
-            seq = want[i+1]
-            v += f' {ndx}.{seq}' + cnt[i] * '*'
-        v += " ]"
-        if self.verbose:
+                if credit > 0 and share[i] < avail[i]:
+                    share[i] += 1
+                    credit -= 1
+                    found_something = True
+        runs = (len(want)-1) * [[]]
+        for i in range(len(want)-1): # fetch each feed's share in one go
+            if share[i] == 0:
+                continue # don't open a replica for nothing
+            try:
+                fid = self.goset.keys[(offs + i) % len(self.goset.keys)]
+                runs[i] = self._replica(fid).get_entry_pkts(want[i+1],
+                                                            share[i])
+                cnt[i] = len(runs[i])
+            except Exception as e:
+                print("   error incoming WANT")
+                traceback.print_exc()
+        for r in range(max(cnt, default=0)): # same order as round-robin
+            for i in range(len(want)-1):
+                if r < cnt[i]:
+                    lst.append(runs[i][r])
+
+        if self.verbose: # (the served pkts are read-only views if mmap'ed)
+            v = "   =W ["
+            for i in range(len(cnt)):
+                ndx = (offs + i) % len(self.goset.keys)
+                seq = want[i+1]
+                v += f' {ndx}.{seq}' + cnt[i] * '*'
+            v += " ]"
             print(v, [x[:10].hex()+".." for x in lst])
         return lst
 
@@ -335,7 +658,7 @@ class PubNode:
                 try:
                     fNDX, seq, cnr = vect[i]
                     fid = self.goset.keys[fNDX]
-                    chunk = self.reps[fid].get_chunk_pkt(seq, cnr + cnt[i])
+                    chunk = self._replica(fid).get_chunk_pkt(seq, cnr + cnt[i])
                 except Exception as e:
                     print("   incoming CHNK error")
                     print(vect[i])
@@ -349,13 +672,12 @@ class PubNode:
                     found_something = False
                     break
                 found_something = True
-        v = "   =C ["
-        for i in range(len(cnt)):
-            fNDX, seq, cnr = vect[i]
-            fid = self.goset.keys[fNDX]
-            v += f" {fNDX}.{seq}.{cnr}" + cnt[i] * "*"
-        v += " ]"
         if self.verbose:
+            v = "   =C ["
+            for i in range(len(cnt)):
+                fNDX, seq, cnr = vect[i]
+                v += f" {fNDX}.{seq}.{cnr}" + cnt[i] * "*"
+            v += " ]"
             print(v, [x[:10].hex()+".." for x in lst])
         return lst
     
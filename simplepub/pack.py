@@ -0,0 +1,309 @@
+#
+
+# simplepub/pack.py  -- packfile storage: the entries of all feeds appended
+#                       to a few shared segment files
+
+import hashlib
+import mmap
+import os
+
+from . import bipf
+from . import cache
+from . import replica
+
+SEG_MAX = 256*1024*1024 # start a new segment file beyond this size
+CKPT_MIN = 16*1024*1024 # checkpoint after this many appended bytes
+HDR_LEN = 40            # record header: fid, seq, length of sidechain space
+
+'''
+A segment record holds one log entry:
+
+  fid (32B) | seq (4B) | sclen (4B) | entry pkt (120B) | sidechain (sclen B) | ptr (4B)
+
+where ptr is the record's offset in the segment, as the back pointer in a
+2FPF log.bin file. Positions are global: the segment number is in the upper
+32 bits, the offset inside the segment in the lower 32 bits.
+
+The per-feed frontiers and the positions of all entries are kept in memory
+and saved in a checkpoint file. At startup, the records appended after the
+last checkpoint are validated like the tail of a 2FPF log (dmx chain and
+back pointer) and added to the feeds' frontiers; chunks written after the
+checkpoint are rolled forward when a feed's replica is opened.
+'''
+
+
+class PackStore:
+
+    def __init__(self, datapath, fpool=None, durability='none',
+                 use_mmap=False):
+        self.path = datapath + '/pack/'
+        self.ckpt_fname = self.path + 'checkpoint.bin'
+        self.fpool = cache.FilePool(4) if fpool == None else fpool
+        self.durability = durability
+        self.use_mmap = use_mmap
+        self.mm = {}    # segment nr -> memoryview of a read-only map of it
+        self.feeds = {} # fid -> [state, idx, ends], 8B positions per entry
+        self.tail = 0   # where the next record is appended
+        self.appended = 0 # bytes appended since the last checkpoint
+        self.unsynced = set() # segments written since the last fsync
+        if not os.path.isdir(self.path):
+            os.mkdir(self.path)
+        try:
+            with open(self.ckpt_fname, 'rb') as f:
+                ckpt = bipf.loads(f.read())
+            self.tail = ckpt['tail']
+            for fid, (state, idx, ends) in ckpt['feeds'].items():
+                self.feeds[fid] = [state, bytearray(idx), bytearray(ends)]
+        except FileNotFoundError:
+            pass
+        if not os.path.isfile(self._seg_fname(self.tail >> 32)):
+            open(self._seg_fname(self.tail >> 32), 'wb').close()
+        self._recover()
+
+    def _seg_fname(self, seg):
+        return self.path + f"seg-{seg:05d}.bin"
+
+    def _recover(self): # add the records appended after the checkpoint
+        cnt = 0
+        while True:
+            seg, off = self.tail >> 32, self.tail & 0xffffffff
+            fname = self._seg_fname(seg)
+            if off >= os.path.getsize(fname):
+                if not os.path.isfile(self._seg_fname(seg+1)):
+                    break
+                self.tail = (seg+1) << 32
+                continue
+            buf = self.read(self.tail, HDR_LEN + 120)
+            fid = bytes(buf[:32])
+            seq = int.from_bytes(buf[32:36], 'big')
+            sclen = int.from_bytes(buf[36:40], 'big')
+            feed = self.feeds.get(fid, None)
+            state = self.new_state(fid) if feed == None else feed[0]
+            nam = replica.PFX + fid + seq.to_bytes(4,'big') + state['prev']
+            pkt = buf[HDR_LEN:]
+            end = self.tail + HDR_LEN + 120 + sclen
+            if len(buf) < HDR_LEN + 120 or seq != state['max_seq'] + 1 or \
+               hashlib.sha256(nam).digest()[:7] != pkt[:7] or \
+               self.read(end, 4) != off.to_bytes(4, 'big'):
+                print('truncating segment file')
+                self.mm = {}
+                self.fpool.release(fname)
+                with open(fname, 'r+b') as f:
+                    f.truncate(off)
+                while os.path.isfile(self._seg_fname(seg+1)): # stale
+                    seg += 1
+                    os.remove(self._seg_fname(seg))
+                break
+            if feed == None:
+                feed = self.new_feed(fid)
+            chunk_cnt, ptr = replica.sidechain_len(pkt)
+            pos = self.tail + HDR_LEN
+            if sclen > 0:
+                state['pend_sc'][seq] = [0, chunk_cnt, ptr, pos + 120]
+            elif chunk_cnt > 0:
+                state['dfr_sc'][seq] = chunk_cnt
+            state['max_seq'] = seq
+            state['max_pos'] = end + 4
+            state['prev'] = hashlib.sha256(nam + pkt).digest()[:20]
+            feed[1] += pos.to_bytes(8, 'big')
+            feed[2] += (end + 4).to_bytes(8, 'big')
+            self.tail = end + 4
+            self.appended += end + 4 - pos + HDR_LEN
+            cnt += 1
+        if cnt > 0:
+            print(f"  recovered {cnt} entries appended after the checkpoint")
+
+    def new_state(self, fid):
+        return {'pend_sc': {}, 'dfr_sc': {},
+                'max_seq': 0, 'max_pos': 0, 'prev': fid[:20]}
+
+    def new_feed(self, fid):
+        self.feeds[fid] = [self.new_state(fid), bytearray(), bytearray()]
+        return self.feeds[fid]
+
+    def read(self, pos, cnt): # bytes, or memoryview if mmap'ed
+        seg, off = pos >> 32, pos & 0xffffffff
+        if not self.use_mmap:
+            return os.pread(self.fpool.fileno(self._seg_fname(seg)), cnt, off)
+        mv = self.mm.get(seg, None)
+        if mv == None or (len(mv) < off + cnt and seg == self.tail >> 32):
+            try: # (re)map a segment, as Replica._read_log() does
+                mv = memoryview(mmap.mmap(self.fpool.fileno(
+                                self._seg_fname(seg)), 0, access=mmap.ACCESS_READ))
+            except ValueError: # empty file
+                return b''
+            self.mm[seg] = mv
+        return mv[off:off+cnt]
+
+    def write(self, pos, buf):
+        os.pwrite(self.fpool.fileno(self._seg_fname(pos >> 32)),
+                  buf, pos & 0xffffffff)
+        self.unsynced.add(pos >> 32)
+
+    def append(self, fid, seq, log_entries): # list of (data,hole) -> [pos]
+        # pos is where the entry's pkt starts, as for Replica._append_log()
+        feed = self.feeds[fid]
+        starts = []
+        wpos = self.tail
+        buf = []
+        for data, hole in log_entries:
+            sclen = len(data) - 120 + hole
+            seg, off = self.tail >> 32, self.tail & 0xffffffff
+            if off > 0 and off + HDR_LEN + 120 + sclen + 4 > SEG_MAX:
+                self.write(wpos, b''.join(buf))
+                self.mm.pop(seg, None) # sealed, map it again in full
+                seg, off = seg + 1, 0
+                open(self._seg_fname(seg), 'wb').close()
+                self.tail = wpos = seg << 32
+                buf = []
+            buf += [fid, seq.to_bytes(4, 'big'), sclen.to_bytes(4, 'big'),
+                    data]
+            if hole >= replica.SPARSE_MIN:
+                self.write(wpos, b''.join(buf))
+                wpos = self.tail + HDR_LEN + len(data) + hole
+                buf = []
+            elif hole > 0:
+                buf.append(bytes(hole))
+            buf.append(off.to_bytes(4, 'big'))
+            starts.append(self.tail + HDR_LEN)
+            self.tail += HDR_LEN + 120 + sclen + 4
+            self.appended += HDR_LEN + 120 + sclen + 4
+            feed[1] += starts[-1].to_bytes(8, 'big')
+            feed[2] += self.tail.to_bytes(8, 'big')
+            seq += 1
+        self.write(wpos, b''.join(buf))
+        return starts
+
+    def busy_segments(self): # segments still written to, see get_segments()
+        busy = set([self.tail >> 32])
+        for state, _, _ in self.feeds.values():
+            busy.update(p[3] >> 32 for p in state['pend_sc'].values())
+        return busy
+
+    def sync(self): # fsync the segments written to
+        for seg in self.unsynced:
+            os.fsync(self.fpool.fileno(self._seg_fname(seg)))
+        self.unsynced.clear()
+
+    def commit(self): # called periodically by the node
+        if self.durability != 'none':
+            self.sync()
+        if self.appended >= CKPT_MIN:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.sync() # the checkpoint must not be ahead of the segments
+        feeds = {fid: [f[0], bytes(f[1]), bytes(f[2])]
+                 for fid, f in self.feeds.items()}
+        buf = bipf.dumps({'tail': self.tail, 'feeds': feeds})
+        with open(self.ckpt_fname + '.tmp', 'wb') as f:
+            f.write(buf)
+            os.fsync(f.fileno())
+        os.replace(self.ckpt_fname + '.tmp', self.ckpt_fname)
+        self.appended = 0
+
+    def close(self):
+        self.checkpoint()
+
+
+class PackReplica(replica.Replica):
+    # a feed kept in a PackStore, with the interface of a 2FPF Replica.
+    # It has no files of its own
+
+    def __init__(self, store, fid, verify_fct, ccache=None, budget=None,
+                 commit_every=1, verify_batch_fct=None):
+        self.store = store
+        self.fid = fid
+        self.verify_fct = verify_fct
+        self.verify_batch_fct = verify_batch_fct
+        self.is_author = False
+        self.fpool = store.fpool
+        self.use_mmap = store.use_mmap
+        self.ccache = ccache
+        self.budget = cache.ChainBudget() if budget == None else budget
+        self.durability = store.durability
+        self.commit_every = 1 if self.durability == 'strict' else commit_every
+        self.dirty = 0
+        if not fid in store.feeds:
+            store.new_feed(fid)
+        self.state, self.idx, self.ends = store.feeds[fid]
+        self._roll_forward()
+        self.budget.set_feed(fid, self.get_pending_bytes())
+        self.flush()
+
+    def _entry_pos(self, seq):
+        return int.from_bytes(self.idx[8*seq-8:8*seq], 'big')
+
+    def _entry_end(self, seq):
+        return int.from_bytes(self.ends[8*seq-8:8*seq], 'big')
+
+    def _seg_of(self, pos):
+        return pos >> 32
+
+    def _log_size(self): # the feed's records end where its frontier says
+        return self.state['max_pos']
+
+    def _read_log(self, pos, cnt):
+        return self.store.read(pos, cnt)
+
+    def _write_log(self, pos, buf):
+        self.store.write(pos, buf)
+
+    def _log_room(self, n): # the length of its sidechain space is 4B
+        return n - 124 < 1 << 32
+
+    def _append_log(self, log_entries):
+        return self.store.append(self.fid, self.state['max_seq'] + 1,
+                                 log_entries)
+
+    def _frontier_changed(self, recs): # the state is saved by the store
+        self.dirty += 1
+        if self.durability != 'interval' and self.dirty >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        if self.dirty == 0:
+            return
+        if self.durability == 'strict':
+            self.store.sync()
+        self.dirty = 0
+
+    def _iter_records(self, start, stop, whole): # entries are not contiguous
+        stop = self.state['max_seq'] + 1 if stop == None else \
+               min(stop, self.state['max_seq'] + 1)
+        for seq in range(max(start, 1), stop):
+            pos = self._entry_pos(seq)
+            n = self._entry_end(seq) - pos - 4 if whole(seq) else 120
+            yield seq, memoryview(self._read_log(pos, n))
+
+    def import_entry(self, pkt, chunks, deferred=False):
+        # append an entry that was validated by another backend, together
+        # with the chunks received so far
+        seq = self.state['max_seq'] + 1
+        nam = replica.PFX + self.fid + seq.to_bytes(4,'big') + \
+              self.state['prev']
+        chunk_cnt, ptr = replica.sidechain_len(pkt)
+        sc_len = 0 if deferred else 120 * chunk_cnt
+        data = bytes(pkt) + b''.join(chunks)
+        if not self._log_room(120 + sc_len + 4):
+            raise ValueError(f"entry {seq} is too large for a packfile")
+        pos = self._append_log([(data, 120 + sc_len - len(data))])[0]
+        if deferred:
+            self.state['dfr_sc'][seq] = chunk_cnt
+        elif chunk_cnt > 0:
+            self.state['pend_sc'][seq] = [0, chunk_cnt, ptr, pos + 120]
+        self._persist_frontier(seq, pos + 120 + sc_len + 4,
+                               hashlib.sha256(nam + pkt).digest()[:20])
+        for c in chunks:
+            self._frontier_changed([self._advance_chain(seq, c)])
+
+    def get_segments(self): # [(fname, start_pos, frozen)]
+        # the shared segments holding the feed's records. These also hold
+        # other feeds, so a segment is frozen if no feed writes to it
+        segs = sorted(set(int.from_bytes(self.idx[i:i+4], 'big')
+                          for i in range(0, len(self.idx), 8)))
+        busy = self.store.busy_segments()
+        return [(self.store._seg_fname(i), i << 32, not i in busy)
+                for i in segs]
+
+# eof
@@ -3,11 +3,14 @@
 # tinyssb/replica.py  -- inject and ingest tinySSB content
 # 2023-07-08 <christian.tschudin@unibas.ch>
 
+import bisect
 import hashlib
+import mmap
 import os
 import traceback
 
 from . import bipf
+from . import cache
 
 PKTTYPE_plain48    = 0x00     # ed25519 signature, single packet with 48B
 PKTTYPE_chain20    = 0x01     # ed25519 signature, start of hash sidechain
@@ -24,125 +27,489 @@ PKTTYPE_acknldg    = 0x06     # proof of having seen some fid:seq:sig entry
 
 PFX = b'tinyssb-v0'
 
+# frontier journal records, appended to frontier.jnl as BIPF lists
+JNL_ENTRY = 1   # [JNL_ENTRY, seq, max_pos, prev] + [pend] if sidechain
+JNL_CHUNK = 2   # [JNL_CHUNK, seq, cnr, next_hptr]
+JNL_CLOSE = 3   # [JNL_CLOSE, seq]
+JNL_DEFER = 4   # [JNL_DEFER, seq, chunk_cnt], entry stored without sidechain
+JNL_SEG = 5     # [JNL_SEG, start_pos], log continues in a new segment file
+JNL_MIN_COMPACT = 16*1024 # compact if journal > max(this, 4*frontier size)
+
+ITER_BLOCK = 64*1024 # read size when streaming a log forward
+READAHEAD_MAX = 16*1024 # max span of one read serving consecutive entries
+SPARSE_MIN = 4096 # sidechain space from this size on is left as a file hole
+LOG_SEG_MAX = 64*1024*1024 # start a new log segment beyond this size
+
+# durability modes: when are log and frontier updates fsync'ed
+DURABILITY = ['none',     # never, leave it to the OS
+              'interval', # on flush(), which the owner calls periodically
+              'strict']   # on every update, before the ingest call returns
+
+
+def sidechain_len(pkt): # (chunk_cnt, hptr of first chunk) of an entry pkt
+    if pkt[7] != PKTTYPE_chain20:
+        return (0, None)
+    content_len, sz = bipf.varint_decode(pkt, 8)
+    content_len -= 48 - 20 - sz
+    return (max(0, (content_len + 99) // 100), bytes(pkt[36:56]))
+
+def seg_fname(path, i): # name of the i-th segment of a feed's log
+    return path + ('log.bin' if i == 0 else f"log-{i:05d}.bin")
+
 
 class Replica:
 
-    def __init__(self, datapath, fid, verify_fct, is_author=False):
+    def __init__(self, datapath, fid, verify_fct, is_author=False,
+                 use_mmap=False, fpool=None, commit_every=1, ccache=None,
+                 budget=None, durability='none', verify_batch_fct=None):
         self.path = datapath + '/' + fid.hex() + '/'
         self.log_fname = self.path + 'log.bin'
         self.fnt_fname = self.path + 'frontier.bin'
         self.tmp_fname = self.path + 'frontier.tmp'
+        self.jnl_fname = self.path + 'frontier.jnl'
+        self.idx_fname = self.path + 'index.bin'
         self.fid = fid
         self.verify_fct = verify_fct
+        self.verify_batch_fct = verify_batch_fct # [(pk,sig,msg)] -> [bool]
         self.is_author = is_author
+        self.use_mmap = use_mmap
+        self.fpool = cache.FilePool(2) if fpool == None else fpool
+        assert durability in DURABILITY
+        self.durability = durability
+        self.commit_every = 1 if durability == 'strict' else commit_every
+        self.ccache = ccache # shared cache of reassembled sidechains, or None
+        self.budget = cache.ChainBudget() if budget == None else budget
+        self.dirty = 0 # number of frontier updates not yet persisted
+        self.jnl = []  # their encoded journal records
+        self.mm = {}   # segment nr -> memoryview of a read-only map of it
+        self.unsynced = set() # segments written to since the last fsync
+        self.idx_synced = 0   # length of index.bin at the last fsync
         
         if not os.path.isdir(self.path):
             os.mkdir(self.path)
         if not os.path.isfile(self.log_fname):
             open(self.log_fname, 'wb').close()
-            self.state = {'pend_sc': {}} # pend. sidechains {seq:[cnr,remain,hptr,pos_to_write]}
-            self._persist_frontier(0, 0, fid[:20])
+            open(self.idx_fname, 'wb').close()
+            self.state = {'pend_sc': {}, # pend. sidechains {seq:[cnr,remain,hptr,pos_to_write]}
+                          'dfr_sc': {},  # deferred sidechains {seq:chunk_cnt}
+                          'max_seq': 0, 'max_pos': 0, 'prev': fid[:20]}
+            self._compact()
         # keep frontier in memory
         with open(self.fnt_fname, 'rb') as f:
             buf = f.read()
+        self.fnt_size = len(buf)
         self.state = bipf.loads(buf)
+        self.state.setdefault('dfr_sc', {})
+        self.state.setdefault('segs', [0]) # start pos of each log segment
+        self._replay_journal()
+        segs = self.state['segs']
+        while os.path.isfile(seg_fname(self.path, len(segs))):
+            # segment not in the table: it starts where the previous ends
+            segs.append(self._log_size())
+            self._frontier_changed([[JNL_SEG, segs[-1]]])
+        if not os.path.isfile(seg_fname(self.path, len(segs)-1)):
+            # crashed after logging a new segment, but before creating it
+            open(seg_fname(self.path, len(segs)-1), 'wb').close()
         # print(f"  replica {fid.hex()} state:")
         # print(f"    {self.state}")
-        while os.path.getsize(self.log_fname) > self.state['max_pos']:
-            with open(self.log_fname, 'r+b') as f:
-                pos = self.state['max_pos']
-                f.seek(pos, os.SEEK_SET)
-                pkt = f.read(120)
-                seq = self.state['max_seq'] + 1
-                nam = PFX + self.fid + seq.to_bytes(4,'big') + self.state['prev']
-                dmx = hashlib.sha256(nam).digest()[:7]
-                if self.is_author or dmx != pkt[:7]:
-                    print('truncating log file')
-                    f.seek(pos, os.SEEK_SET)
-                    f.truncate()
-                    break
-                chunk_cnt = 0
-                if pkt[7] == PKTTYPE_chain20:
-                    content_len, sz = bipf.varint_decode(pkt, 8)
-                    content_len -= 48 - 20 - sz
-                    ptr = pkt[36:56]
-                    chunk_cnt = (content_len + 99) // 100
-                if chunk_cnt > 0:
-                    self.state['pend_sc'][seq] = [0, chunk_cnt, ptr, pos + 120]
-                while chunk_cnt > 0: # allocate sidechain space in the file
-                    f.write(bytes(120))
-                    chunk_cnt -= 1
-                f.write(pos.to_bytes(4,'big'))
-                pos = f.tell()
-            self._persist_frontier(seq, pos,
+        self._load_index()
+        while self._log_size() > self.state['max_pos']:
+            pos = self.state['max_pos']
+            pkt = self._read_log(pos, 120)
+            seq = self.state['max_seq'] + 1
+            nam = PFX + self.fid + seq.to_bytes(4,'big') + self.state['prev']
+            dmx = hashlib.sha256(nam).digest()[:7]
+            if self.is_author or len(pkt) < 120 or dmx != pkt[:7]:
+                print('truncating log file')
+                if self.ccache != None:
+                    self.ccache.drop_feed(self.fid, seq)
+                self._truncate_log(pos)
+                break
+            chunk_cnt, ptr = sidechain_len(pkt)
+            back = self._back_ptr(pos)
+            sc_len = 120 * chunk_cnt
+            if self._read_log(pos + 120 + sc_len, 4) != back:
+                # else keep chunks already received
+                if sc_len > 0 and self._read_log(pos + 120, 4) == back:
+                    sc_len = 0 # stored without its (deferred) sidechain
+                else:
+                    # entry was not completely written: drop partial data,
+                    # the back pointer leaves sidechain space as a hole
+                    if sc_len > 0 and not self.budget.reserve(self.fid, sc_len):
+                        sc_len = 0
+                    self._truncate_log(pos + 120)
+                    self._write_log(pos + 120 + sc_len, back)
+            if sc_len > 0:
+                self.state['pend_sc'][seq] = [0, chunk_cnt, ptr, pos + 120]
+            elif chunk_cnt > 0:
+                self.state['dfr_sc'][seq] = chunk_cnt
+            self._append_index(pos)
+            self._persist_frontier(seq, pos + 120 + sc_len + 4,
                                    hashlib.sha256(nam + pkt).digest()[:20])
+        self._roll_forward()
+        self.budget.set_feed(self.fid, self.get_pending_bytes())
+        self.flush()
 
-    def _persist_frontier(self, seq, pos, prev):
+    def _roll_forward(self):
+        for seq, pend in list(self.state['pend_sc'].items()):
+            # roll forward chunks that were written after the frontier was
+            # last persisted: a chunk is valid iff its hash is the one expected
+            while True:
+                pkt = self._read_log(pend[3], 120)
+                if len(pkt) < 120 or pend[2] != hashlib.sha256(pkt).digest()[:20]:
+                    break
+                rec = self._advance_chain(seq, pkt)
+                self._frontier_changed([rec])
+                if rec[0] == JNL_CLOSE:
+                    break
+
+    def _load_index(self): # seq->pos table, 8B per entry
+        try:
+            with open(self.idx_fname, 'rb') as f:
+                self.idx = bytearray(f.read())
+        except FileNotFoundError:
+            self.idx = bytearray()
+        cnt = self.state['max_seq']
+        if len(self.idx) > 8*cnt: # frontier was not updated after append
+            del self.idx[8*cnt:]
+            with open(self.idx_fname, 'r+b') as f:
+                f.truncate(8*cnt)
+        if len(self.idx) == 8*cnt:
+            if cnt == 0 or self._read_back_ptr(self.state['max_pos']) == \
+                                     self._entry_pos(cnt):
+                return
+        print('rebuilding index file')
+        self.idx = bytearray(8*cnt)
+        pos = self.state['max_pos']
+        while cnt > 0:
+            pos = self._read_back_ptr(pos)
+            self.idx[8*cnt-8:8*cnt] = pos.to_bytes(8, 'big')
+            cnt -= 1
+        with open(self.idx_fname, 'wb') as f:
+            f.write(self.idx)
+            if self.durability != 'none':
+                os.fsync(f.fileno())
+
+    def _back_ptr(self, pos): # 4B back pointer of the entry starting at pos
+        # relative to its log segment, as an entry never spans two of them
+        return (pos - self.state['segs'][self._seg_of(pos)]).to_bytes(4,'big')
+
+    def _read_back_ptr(self, pos): # start of the entry ending at pos
+        i = self._seg_of(pos - 4)
+        return self.state['segs'][i] + \
+               int.from_bytes(self._read_log(pos - 4, 4), 'big')
+
+    def _append_index(self, pos):
+        ptr = pos.to_bytes(8, 'big')
+        os.pwrite(self.fpool.fileno(self.idx_fname), ptr, len(self.idx))
+        self.idx += ptr
+
+    def _entry_pos(self, seq): # start of entry seq in the log
+        return int.from_bytes(self.idx[8*seq-8:8*seq], 'big')
+
+    def _entry_end(self, seq): # end of entry seq, incl. sidechain and ptr
+        if seq == self.state['max_seq']:
+            return self.state['max_pos']
+        return self._entry_pos(seq+1)
+
+    def _seg_of(self, pos): # nr of the log segment holding position pos
+        return bisect.bisect_right(self.state['segs'], pos) - 1
+
+    def _log_size(self):
+        segs = self.state['segs']
+        return segs[-1] + os.path.getsize(seg_fname(self.path, len(segs)-1))
+
+    def _read_log(self, pos, cnt): # bytes, or memoryview if mmap'ed
+        # an entry never spans two segments, neither may a read
+        i = self._seg_of(pos)
+        fname = seg_fname(self.path, i)
+        pos -= self.state['segs'][i]
+        if not self.use_mmap:
+            return os.pread(self.fpool.fileno(fname), cnt, pos)
+        mv = self.mm.get(i, None)
+        if mv == None or (len(mv) < pos + cnt and
+                          i == len(self.state['segs']) - 1):
+            # active segment has grown: map it again, old slices keep the
+            # old map alive. Sealed segments are mapped once
+            try:
+                mv = memoryview(mmap.mmap(self.fpool.fileno(fname), 0,
+                                          access=mmap.ACCESS_READ))
+            except ValueError: # empty file
+                return b''
+            self.mm[i] = mv
+        return mv[pos:pos+cnt] # slicing the view is the only allocation
+
+    def _write_log(self, pos, buf):
+        i = self._seg_of(pos)
+        os.pwrite(self.fpool.fileno(seg_fname(self.path, i)), buf,
+                  pos - self.state['segs'][i])
+        self.unsynced.add(i)
+
+    def _new_segment(self, pos): # rotate the log, appends go to a new file
+        # log the new segment before anything is written to it. The sealed
+        # one may have grown since it was mapped: map it again when read
+        self.mm.pop(len(self.state['segs']) - 1, None)
+        self.state['segs'].append(pos)
+        self._frontier_changed([[JNL_SEG, pos]])
+        self.flush()
+        open(seg_fname(self.path, len(self.state['segs'])-1), 'wb').close()
+
+    def _truncate_log(self, pos): # drop the log from pos on
+        segs = self.state['segs']
+        i = self._seg_of(pos)
+        if len(segs) > i + 1:
+            while len(segs) > i + 1:
+                self.fpool.release(seg_fname(self.path, len(segs)-1))
+                os.remove(seg_fname(self.path, len(segs)-1))
+                segs.pop()
+            self._compact() # the segment table has shrunk
+        os.truncate(seg_fname(self.path, i), pos - segs[i])
+        self.mm = {}
+
+    def _log_room(self, n): # True if a log record of n bytes can be stored
+        return True # any size: a record's offset in its segment is < 4 GiB
+
+    def _append_log(self, log_entries): # list of (data, hole) -> [start pos]
+        # an entry is its data, 'hole' bytes of (empty) sidechain space and
+        # its back pointer. Large sidechain space is not written but left
+        # as a hole in the file, the back pointer behind it extends the file
+        pos = self.state['max_pos']
+        wpos = pos
+        buf = []
+        ptrs = b''
+        starts = []
+        for data, hole in log_entries:
+            segs = self.state['segs']
+            if pos > segs[-1] and \
+               pos - segs[-1] + len(data) + hole + 4 > LOG_SEG_MAX:
+                self._write_log(wpos, b''.join(buf))
+                self._new_segment(pos)
+                wpos = pos
+                buf = []
+            starts.append(pos)
+            ptrs += pos.to_bytes(8, 'big')
+            ptr = self._back_ptr(pos)
+            buf.append(data)
+            if hole >= SPARSE_MIN:
+                self._write_log(wpos, b''.join(buf))
+                wpos = pos + len(data) + hole
+                buf = []
+            elif hole > 0:
+                buf.append(bytes(hole))
+            buf.append(ptr)
+            pos += len(data) + hole + 4
+        self._write_log(wpos, b''.join(buf))
+        os.pwrite(self.fpool.fileno(self.idx_fname), ptrs, len(self.idx))
+        self.idx += ptrs
+        return starts
+
+    def _entry_records(self, seq, pos, prev): # list of journal records
         self.state['max_seq'] = seq
         self.state['max_pos'] = pos
         self.state['prev'] = prev
+        rec = [JNL_ENTRY, seq, pos, prev]
+        if seq in self.state['pend_sc']:
+            rec.append(self.state['pend_sc'][seq])
+        if seq in self.state['dfr_sc']:
+            return [rec, [JNL_DEFER, seq, self.state['dfr_sc'][seq]]]
+        return [rec]
+
+    def _persist_frontier(self, seq, pos, prev):
+        self._frontier_changed(self._entry_records(seq, pos, prev))
+
+    def _frontier_changed(self, recs): # group commit: flush every N-th update
+        self.jnl += [bipf.dumps(r) for r in recs]
+        self.dirty += 1
+        if self.durability != 'interval' and self.dirty >= self.commit_every:
+            self.flush()
+
+    def _advance_chain(self, seq, pkt): # returns the journal record
+        pend = self.state['pend_sc'][seq] # [cnr, rem, hptr, pos]
+        if pend[1] <= 1: # chain is complete
+            del self.state['pend_sc'][seq]
+            return [JNL_CLOSE, seq]
+        rec = [JNL_CHUNK, seq, pend[0], bytes(pkt[-20:])]
+        pend[0] += 1
+        pend[1] -= 1
+        pend[2] = bytes(pkt[-20:])
+        pend[3] += 120
+        return rec
+
+    def _replay_journal(self): # apply updates made since the last compaction
+        try:
+            with open(self.jnl_fname, 'rb') as f:
+                buf = f.read()
+        except FileNotFoundError:
+            open(self.jnl_fname, 'wb').close()
+            buf = b''
+        pos = 0
+        while pos < len(buf):
+            try:
+                rec, sz = bipf.decode(buf, pos)
+                assert type(rec) == list and pos + sz <= len(buf)
+                self._apply_record(rec)
+            except:
+                print('truncating frontier journal')
+                with open(self.jnl_fname, 'r+b') as f:
+                    f.truncate(pos)
+                break
+            pos += sz
+        self.jnl_size = pos
+
+    def _apply_record(self, rec): # idempotent, records may be replayed twice
+        pend_sc = self.state['pend_sc']
+        if rec[0] == JNL_ENTRY:
+            if rec[1] != self.state['max_seq'] + 1:
+                return
+            self.state['max_seq'], self.state['max_pos'], \
+                                   self.state['prev'] = rec[1:4]
+            if len(rec) > 4:
+                pend_sc[rec[1]] = rec[4]
+        elif rec[0] == JNL_CHUNK:
+            pend = pend_sc.get(rec[1], None)
+            if pend != None and pend[0] == rec[2]:
+                pend[0] += 1
+                pend[1] -= 1
+                pend[2] = rec[3]
+                pend[3] += 120
+        elif rec[0] == JNL_CLOSE:
+            if rec[1] in pend_sc:
+                del pend_sc[rec[1]]
+        elif rec[0] == JNL_DEFER:
+            if rec[1] <= self.state['max_seq']:
+                self.state['dfr_sc'][rec[1]] = rec[2]
+        elif rec[0] == JNL_SEG:
+            if rec[1] > self.state['segs'][-1]:
+                self.state['segs'].append(rec[1])
+        else:
+            raise ValueError('unknown journal record')
+
+    def _compact(self): # write the full frontier, start a new journal
+        buf = bipf.dumps(self.state)
         with open(self.tmp_fname, 'wb') as f:
-            f.write(bipf.dumps(self.state))
+            f.write(buf)
+            if self.durability != 'none':
+                os.fsync(f.fileno())
         os.replace(self.tmp_fname, self.fnt_fname)
+        if self.durability != 'none': # make the rename durable
+            fd = os.open(self.path, os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+        self.fpool.release(self.jnl_fname)
+        open(self.jnl_fname, 'wb').close()
+        self.fnt_size = len(buf)
+        self.jnl_size = 0
     
     # ----------------------------------------------------------------------
     # public methods:
 
     def ingest_entry_pkt(self, pkt, seq): # True/False
-        assert len(pkt) == 120
+        return self.ingest_entry_pkts([pkt], seq) == 1
+
+    def ingest_entry_pkts(self, pkts, seq): # number of entries ingested
+        # validate a run of consecutive entries, then append them to the log
+        # with a single write and a single frontier update
         if seq != self.state['max_seq'] + 1:
             print("   R: wrong seq nr", seq, self.state['max_seq'] + 1)
-            return False
-        nam = PFX + self.fid + seq.to_bytes(4,'big') + self.state['prev']
-        dmx = hashlib.sha256(nam).digest()[:7]
-        if dmx != pkt[:7]:
-            print("   R: wrong dmx", pkt[:7].hex(), dmx.hex())
-            return False
-        if not self.verify_fct(self.fid, pkt[56:], nam + pkt[:56]):
+            return 0
+        prev = self.state['prev']
+        chain = [] # (nam, prev) of each entry
+        for pkt in pkts: # the dmx chain first, then the signatures
+            if len(pkt) != 120:
+                print("   R: wrong entry length", len(pkt))
+                break
+            nam = PFX + self.fid + (seq + len(chain)).to_bytes(4,'big') + prev
+            dmx = hashlib.sha256(nam).digest()[:7]
+            if dmx != pkt[:7]:
+                print("   R: wrong dmx", pkt[:7].hex(), dmx.hex())
+                break
+            prev = hashlib.sha256(nam + pkt).digest()[:20]
+            chain.append((nam, prev))
+        cnt = self._verify_run([(self.fid, pkt[56:], nam + pkt[:56])
+                                for (nam, _), pkt in zip(chain, pkts)])
+        if cnt < len(chain):
             print("   R: signature verify failed")
-            return False
-        chunk_cnt = 0
-        if pkt[7] == PKTTYPE_chain20:
-            content_len, sz = bipf.varint_decode(pkt, 8)
-            content_len -= 48 - 20 - sz
-            ptr = pkt[36:56]
-            chunk_cnt = (content_len + 99) // 100
-        log_entry = pkt + bytes(chunk_cnt * 120)
-        log_entry += self.state['max_pos'].to_bytes(4, 'big')
-        with open(self.log_fname, 'ab') as f:
-            f.write(log_entry)
-        if chunk_cnt > 0:
-            self.state['pend_sc'][seq] = [0, chunk_cnt, ptr,
-                                          self.state['max_pos'] + 120]
-        pos = self.state['max_pos'] + len(log_entry)
+        log_entries = []
+        recs = []
+        for (nam, prev), pkt in zip(chain[:cnt], pkts):
+            chunk_cnt, ptr = sidechain_len(pkt)
+            sc_len = 120 * chunk_cnt
+            if not self._log_room(120 + sc_len + 4):
+                print("   R: entry too large, refused")
+                break
+            if sc_len > 0 and not self.budget.reserve(self.fid, sc_len):
+                # over budget: keep the entry, drop its sidechain for good
+                print(f"   R: dropping sidechain of {chunk_cnt} chunks")
+                self.state['dfr_sc'][seq] = chunk_cnt
+                sc_len = 0
+            log_entries.append((pkt, sc_len))
+            recs.append([seq, prev, chunk_cnt, ptr])
+            seq += 1
+        if len(log_entries) == 0:
+            return 0
+        starts = self._append_log(log_entries)
+        jrecs = []
+        for (seq, prev, chunk_cnt, ptr), pos, (_, sc_len) in \
+                                     zip(recs, starts, log_entries):
+            if sc_len > 0:
+                self.state['pend_sc'][seq] = [0, chunk_cnt, ptr, pos + 120]
+            jrecs += self._entry_records(seq, pos + 120 + sc_len + 4, prev)
         # print(f"   R: fid={self.fid[:10].hex()} max_seq={seq}, max_pos={pos}")
-        self._persist_frontier(seq, pos,
-                               hashlib.sha256(nam + pkt).digest()[:20])
-        return True
+        self._frontier_changed(jrecs)
+        return len(log_entries)
+
+    def _verify_run(self, items): # nr of valid signatures at the start
+        if self.verify_batch_fct != None and len(items) > 1:
+            ok = self.verify_batch_fct(items)
+            return ok.index(False) if False in ok else len(ok)
+        for i in range(len(items)):
+            if not self.verify_fct(*items[i]):
+                return i
+        return len(items)
 
     def ingest_chunk_pkt(self, pkt, seq): # True/False
-        assert len(pkt) == 120
-        try:
-            pend = self.state['pend_sc'][seq] # [cnr, rem, hptr, pos]
-            assert pend[2] == hashlib.sha256(pkt).digest()[:20]
-            with open(self.log_fname, 'r+b') as f:
-                f.seek(pend[3], os.SEEK_SET)
-                f.write(pkt)
-                pos = f.tell()
-        except:
-            return False
-        if pend[1] <= 1: # chain is complete
-            del self.state['pend_sc'][seq]
-        else:
-            pend[0] += 1
-            pend[1] -= 1
-            pend[2] = pkt[-20:]
-            pend[3] = pos
-            # print(f" ? new pending state {pend}")
-        with open(self.tmp_fname, 'wb') as f:
-            f.write(bipf.dumps(self.state))
-        os.replace(self.tmp_fname, self.fnt_fname)
-        return True
+        return self.ingest_chunk_pkts([pkt], seq) == 1
+
+    def ingest_chunk_pkts(self, pkts, seq): # number of chunks ingested
+        # validate a run of consecutive chunks of one sidechain, then write
+        # them with a single write and a single frontier update
+        pend = self.state['pend_sc'].get(seq, None) # [cnr, rem, hptr, pos]
+        if pend == None:
+            return 0
+        hptr = pend[2]
+        cnt = 0
+        for pkt in pkts[:pend[1]]:
+            if len(pkt) != 120 or hptr != hashlib.sha256(pkt).digest()[:20]:
+                break
+            hptr = pkt[-20:]
+            cnt += 1
+        if cnt == 0:
+            return 0
+        self._write_log(pend[3], b''.join(pkts[:cnt]))
+        self.budget.release(self.fid, 120 * cnt)
+        self._frontier_changed([self._advance_chain(seq, pkt)
+                                for pkt in pkts[:cnt]])
+        return cnt
+
+    def flush(self): # persist the frontier if it has unsaved updates
+        if self.dirty == 0:
+            return
+        if self.durability != 'none': # log before the records pointing to it
+            for i in self.unsynced:
+                os.fsync(self.fpool.fileno(seg_fname(self.path, i)))
+            if self.idx_synced != len(self.idx): # recovery only checks
+                os.fsync(self.fpool.fileno(self.idx_fname)) # its last entry
+        self.unsynced.clear()
+        self.idx_synced = len(self.idx)
+        buf = b''.join(self.jnl)
+        os.pwrite(self.fpool.fileno(self.jnl_fname), buf, self.jnl_size)
+        if self.durability != 'none':
+            os.fsync(self.fpool.fileno(self.jnl_fname))
+        self.jnl_size += len(buf)
+        self.jnl = []
+        self.dirty = 0
+        if self.jnl_size > max(JNL_MIN_COMPACT, 4*self.fnt_size):
+            self._compact()
 
     def get_next_seq(self): # (next_seq, dmx)
         seq = self.state['max_seq']+1
@@ -152,21 +519,55 @@ class Replica:
     def get_open_chains(self, cursor=0): # {seq:[cnr,rem,hptr,pos]}
         return self.state['pend_sc']
 
+    def get_deferred_chains(self): # {seq:chunk_cnt}
+        return self.state['dfr_sc']
+
+    def get_pending_bytes(self): # sidechain space reserved but not received
+        return sum([120 * p[1] for p in self.state['pend_sc'].values()])
+
+    def get_segments(self): # [(fname, start_pos, frozen)]
+        # a frozen segment is neither appended to nor holds sidechains still
+        # to be filled in: it is never written again and may be moved away
+        # (e.g. to cold storage, leaving a symlink)
+        segs = self.state['segs']
+        busy = set([len(segs)-1] + [self._seg_of(p[3])
+                                  for p in self.state['pend_sc'].values()])
+        return [(seg_fname(self.path, i), segs[i], not i in busy)
+                for i in range(len(segs))]
+
     def get_entry_pkt(self, seq):
         try:
             assert seq >= 1 and seq <= self.state['max_seq']
-            with open(self.log_fname, 'rb') as f:
-                pos = os.path.getsize(self.log_fname)
-                cnt = self.state['max_seq'] - seq + 1
-                while cnt > 0:
-                    f.seek(pos-4, os.SEEK_SET)
-                    pos = int.from_bytes(f.read(4), byteorder='big')
-                    cnt -= 1
-                f.seek(pos, os.SEEK_SET)
-                return f.read(120)
+            return self._read_log(self._entry_pos(seq), 120)
         except:
             return None
 
+    def get_entry_pkts(self, seq, n): # up to n entry pkts from seq on
+        # consecutive entries are fetched with one read unless they are far
+        # apart (large sidechains) or in different segments
+        pkts = []
+        try:
+            last = min(seq + n - 1, self.state['max_seq'])
+            while seq >= 1 and seq <= last:
+                pos = self._entry_pos(seq)
+                end = seq
+                while end < last and \
+                      self._entry_pos(end + 1) + 120 - pos <= READAHEAD_MAX and \
+                      self._seg_of(self._entry_pos(end + 1)) == self._seg_of(pos):
+                    end += 1
+                buf = memoryview(self._read_log(pos,
+                                        self._entry_pos(end) + 120 - pos))
+                for s in range(seq, end + 1):
+                    pkt = buf[self._entry_pos(s) - pos:][:120]
+                    if len(pkt) < 120:
+                        return pkts
+                    # copy out of a read buffer, don't let it pin the buffer
+                    pkts.append(pkt if self.use_mmap else bytes(pkt))
+                seq = end + 1
+        except:
+            pass
+        return pkts
+
     def get_content_len(self, seq):
         pkt = self.get_entry_pkt(seq)
         if pkt == None:
@@ -175,6 +576,8 @@ class Replica:
             return (48,48)
         if pkt[7] == PKTTYPE_chain20:
             content_len, sz = bipf.varint_decode(pkt, 8)
+            if seq in self.state['dfr_sc']:
+                return (48-20-sz, content_len)
             if not seq in self.state['pend_sc']:
                 return (content_len, content_len)
             available = (48-20-sz) + 100 * self.state['pend_sc'][seq][0]
@@ -187,54 +590,113 @@ class Replica:
             if seq in self.state['pend_sc']:
                 if cnr >= self.state['pend_sc'][seq][0]:
                     return None
-            with open(self.log_fname, 'rb') as f:
-                pos = os.path.getsize(self.log_fname)
-                cnt = self.state['max_seq'] - seq + 1
-                while cnt > 0:
-                    f.seek(pos-4, os.SEEK_SET)
-                    lim = pos
-                    pos = int.from_bytes(f.read(4), byteorder='big')
-                    cnt -= 1
-                pos += 120*(cnr+1)
-                if pos > lim-120:
-                    return None
-                f.seek(pos, os.SEEK_SET)
-                return f.read(120)
+            pos = self._entry_pos(seq) + 120*(cnr+1)
+            if pos + 120 > self._entry_end(seq) - 4:
+                return None
+            return self._read_log(pos, 120)
         except:
             return None
 
+    def iter_chunks(self, seq): # (cnr, pos, chunk pkt) of a complete chain
+        if seq < 1 or seq > self.state['max_seq'] or \
+           seq in self.state['pend_sc'] or seq in self.state['dfr_sc']:
+            return
+        pos = self._entry_pos(seq)
+        cnt = (self._entry_end(seq) - pos - 124) // 120
+        if cnt <= 0:
+            return
+        buf = self._read_log(pos + 120, 120 * cnt)
+        for i in range(cnt):
+            yield i, pos + 120*(i+1), buf[120*i:120*(i+1)]
+
+    def get_chunk_at(self, pos): # chunk at a log position, from iter_chunks()
+        return self._read_log(pos, 120)
+
     def read(self, seq): #, offs=0, lim=0):
         if self.state['max_seq'] < seq or seq < 1:
             return None
-        with open(self.log_fname, 'rb') as f:
-            pos = os.path.getsize(self.log_fname)
-            cnt = self.state['max_seq'] - seq + 1
-            while cnt > 0:
-                f.seek(pos-4, os.SEEK_SET)
-                pos = int.from_bytes(f.read(4), byteorder='big')
-                cnt -= 1
-            f.seek(pos, os.SEEK_SET)
-            pkt = f.read(120)
-            if pkt[7] == PKTTYPE_plain48:
-                return pkt[8:56]
-            if pkt[7] != PKTTYPE_chain20:
-                return None
-            chain_len, sz = bipf.varint_decode(pkt[8:])
-            content = pkt[8+sz:36]
-            blocks = (chain_len - len(content) + 99) // 100
-            while blocks > 0:
-                pkt = f.read(120)
-                content += pkt[:100]
-                blocks -= 1
-        return content[:chain_len]
+        pos = self._entry_pos(seq)
+        pkt = self._read_log(pos, 120)
+        if pkt[7] == PKTTYPE_plain48:
+            return bytes(pkt[8:56])
+        if pkt[7] != PKTTYPE_chain20 or seq in self.state['dfr_sc']:
+            return None
+        complete = not seq in self.state['pend_sc']
+        if complete and self.ccache != None:
+            content = self.ccache.get(self.fid, seq)
+            if content != None:
+                return content
+        chain_len, sz = bipf.varint_decode(pkt, 8)
+        blocks = (chain_len - (28 - sz) + 99) // 100
+        buf = self._read_log(pos, 120 * (blocks + 1))
+        content = bytes(self._chain_content(buf))
+        if complete and self.ccache != None:
+            self.ccache.put(self.fid, seq, content)
+        return content
+
+    def _chain_content(self, rec): # rec: entry pkt followed by its chunks
+        chain_len, sz = bipf.varint_decode(rec, 8)
+        content = bytearray(rec[8+sz:36])
+        for i in range(120, len(rec) - 119, 120):
+            content += rec[i:i+100]
+        return memoryview(content)[:chain_len]
+
+    def _iter_records(self, start, stop, whole):
+        # (seq, entry pkt + sidechain if whole(seq), else the entry pkt only)
+        stop = self.state['max_seq'] + 1 if stop == None else \
+               min(stop, self.state['max_seq'] + 1)
+        # records without sidechain, and the whole ones if wanted, are read
+        # in blocks. Sidechain space that is not wanted (pending, or a hole)
+        # is never read, a record larger than a block is read on its own
+        batch = lambda s: whole(s) or \
+                          self._entry_end(s) - self._entry_pos(s) == 124
+        seq = max(start, 1)
+        while seq < stop:
+            pos = self._entry_pos(seq)
+            end = self._entry_end(seq)
+            if not batch(seq) or end - pos > ITER_BLOCK:
+                n = end - pos - 4 if whole(seq) else 120
+                yield seq, memoryview(self._read_log(pos, n))
+                seq += 1
+                continue
+            last = seq
+            while last + 1 < stop and batch(last + 1) and \
+                  self._entry_end(last + 1) - pos <= ITER_BLOCK and \
+                  self._seg_of(self._entry_pos(last + 1)) == self._seg_of(pos):
+                last += 1
+            buf = memoryview(self._read_log(pos,self._entry_end(last)-pos))
+            for s in range(seq, last + 1):
+                yield s, buf[self._entry_pos(s) - pos:
+                             self._entry_end(s) - pos - 4]
+            seq = last + 1
+
+    def iter_entries(self, start=1, stop=None): # (seq, entry_pkt)
+        # stream the entries start..stop-1, walking the log forward once
+        for seq, rec in self._iter_records(start, stop, lambda s: False):
+            yield seq, rec[:120]
+
+    def iter_content(self, start=1, stop=None): # (seq, entry_pkt, content)
+        # content is a memoryview, or None if the sidechain is incomplete or
+        # deferred, or the packet type is unknown
+        complete = lambda s: not s in self.state['pend_sc'] and \
+                             not s in self.state['dfr_sc']
+        for seq, rec in self._iter_records(start, stop, complete):
+            if rec[7] == PKTTYPE_plain48:
+                yield seq, rec[:120], rec[8:56]
+            elif rec[7] == PKTTYPE_chain20 and \
+                 not seq in self.state['pend_sc'] and \
+                 not seq in self.state['dfr_sc']:
+                yield seq, rec[:120], self._chain_content(rec)
+            else:
+                yield seq, rec[:120], None
 
     # ----------------------------------------------------------------------
     # the following is not needed for mere forwarding repos (pubs)
     
     def write48(self, content, sign_fct): # publish event, returns seq or None
-        assert os.path.getsize(self.log_fname) == self.state['max_pos']
+        assert self._log_size() == self.state['max_pos']
         if len(content) < 48:
-            content + bytes(48 - len(content))
+            content += bytes(48 - len(content))
         else:
             content = content[:48]
         seq = self.state['max_seq'] + 1
@@ -245,14 +707,13 @@ class Replica:
         wire = msg + sign_fct(nam + msg)
         assert len(wire) == 120
         assert self.verify_fct(self.fid, wire[56:], nam + wire[:56])
-        with open(self.log_fname, 'ab') as f:
-            f.write(wire + self.state['max_pos'].to_bytes(4, 'big'))
-        self._persist_frontier(seq, len(wire) + 4,
+        pos = self._append_log([(wire, 0)])[0] + 124
+        self._persist_frontier(seq, pos,
                                hashlib.sha256(nam + wire).digest()[:20])
         return seq
 
     def write(self, content, sign_fct): # publish event, returns seq or None
-        assert os.path.getsize(self.log_fname) == self.state['max_pos']
+        assert self._log_size() == self.state['max_pos']
         chunks = []
         seq = self.state['max_seq'] + 1
         sz = bipf.varint_encode_to_bytes(len(content))
@@ -279,11 +740,11 @@ class Replica:
         assert len(wire) == 120
         assert self.verify_fct(self.fid, wire[56:], nam + wire[:56])
         chunks.insert(0, wire)
-        log_entry = b''.join(chunks)
-        log_entry += self.state['max_pos'].to_bytes(4, 'big')
-        with open(self.log_fname, 'ab') as f:
-            f.write(log_entry)
-        self._persist_frontier(seq, self.state['max_pos'] + len(log_entry),
+        buf = b''.join(chunks)
+        if not self._log_room(len(buf) + 4):
+            return None
+        pos = self._append_log([(buf, 0)])[0] + len(buf) + 4
+        self._persist_frontier(seq, pos,
                                hashlib.sha256(nam + wire).digest()[:20])
         return seq
     
@@ -13,6 +13,7 @@ import websockets
 
 WS_PORT = 8080
 
+import simplepub.crypto
 import simplepub.node
 
 # ---------------------------------------------------------------------------
@@ -42,6 +43,14 @@ async def launch_adv(wsock, get_adv_fct, args):
             await wsock.send(p)
         await asyncio.sleep(tout)
         
+async def launch_tick(node):
+    while True:
+        try:
+            node.tick()
+        except Exception: # keep ticking, or no feed would be flushed
+            traceback.print_exc()
+        await asyncio.sleep(0.1)
+
 async def onConnect(wsock, node, args):
     global i_pkt_cnt, o_pkt_cnt
     if args.v: print("-- connection up")
@@ -79,7 +88,17 @@ async def main(args):
     stop = loop.create_future()
     loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
 
-    node = simplepub.node.PubNode(args.d, args.role, args.v)
+    node = simplepub.node.PubNode(args.d, args.role, args.v, args.mmap,
+                                  args.files, args.commit, args.commit_ms/1000,
+                                  args.batch, lazy=args.lazy,
+                                  chain_max=args.budget[0],
+                                  feed_pend_max=args.budget[1],
+                                  node_pend_max=args.budget[2],
+                                  durability=args.durability,
+                                  backend=args.backend,
+                                  chunk_index=args.chunk_index,
+                                  sig_backend=args.crypto)
+    ticker = asyncio.create_task(launch_tick(node))
 
     try:
         if type(args.uri_or_port) == int:
@@ -93,6 +112,8 @@ async def main(args):
                 await onConnect(wsock, node, args)
     except (KeyboardInterrupt, asyncio.exceptions.CancelledError):
         pass
+    ticker.cancel()
+    node.close()
 
 # ---------------------------------------------------------------------------
 
@@ -109,10 +130,36 @@ if __name__ == "__main__":
                     help='TCP port if responder, URI if intiator (default is ws://127.0.0.1:8080)')
     ap.add_argument('-v', action='store_true', default=False,
                     help='print i/o timestamps')
+    ap.add_argument('-mmap', action='store_true', default=False,
+                    help='serve packets from memory-mapped logs')
+    ap.add_argument('-files', type=int, default=256, metavar='N',
+                    help='max number of open log files (default: 256)')
+    ap.add_argument('-commit', type=int, default=1, metavar='N',
+                    help='persist a frontier after N updates (default: 1)')
+    ap.add_argument('-commit_ms', type=int, default=1000, metavar='MS',
+                    help='... or after MS millisec (default: 1000)')
+    ap.add_argument('-batch', type=int, default=32, metavar='N',
+                    help='ingest up to N buffered entries at once (default: 32)')
+    ap.add_argument('-lazy', type=int, default=0, metavar='N',
+                    help='keep at most N replicas open, others on demand')
+    ap.add_argument('-durability', choices=['none','interval','strict'],
+                    default='none',
+                    help='fsync logs and frontiers never, every commit_ms, or on each update (default: none)')
+    ap.add_argument('-backend', choices=['2fpf','pack'], default=None,
+                    help='storage backend (default: pack if DATAPATH/pack exists, else 2fpf)')
+    ap.add_argument('-chunk_index', action='store_true', default=False,
+                    help='keep an index of chunks by their hash')
+    ap.add_argument('-crypto', choices=list(simplepub.crypto.BACKENDS),
+                    default=None,
+                    help='signature backend (default: the first installed of nacl, cryptography, pure25519)')
+    ap.add_argument('-budget', type=str, default='-,-,-', metavar='E,F,N',
+                    help="max MB of pending sidechains per entry, feed and node, '-' for no limit; chains over budget are dropped (default: -,-,-)")
     
     args = ap.parse_args()
     if args.uri_or_port.isdigit():
         args.uri_or_port = int(args.uri_or_port)
+    args.budget = [None if x == '-' else int(x)*1024*1024
+                   for x in args.budget.split(',')]
 
     asyncio.run(main(args))
 
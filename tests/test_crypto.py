@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+
+# tests/test_crypto.py
+# Ed25519: the joint multiplication in open() and batch verification give
+# the same results as the plain computations
+
+import os
+import sys
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pure25519
+from pure25519 import basic
+from simplepub import crypto
+
+def signed(n): # [(vk, sig, msg)] of n messages by a new key
+    vk, skvk = pure25519.publickey(os.urandom(32))
+    items = []
+    for i in range(n):
+        msg = os.urandom(56)
+        items.append((vk, pure25519.sign(msg, skvk)[:64], msg))
+    return items
+
+def verdict(vk, sig, msg):
+    try:
+        pure25519.open(sig + msg, vk)
+        return True
+    except pure25519.BadSignatureError:
+        return False
+
+def open_separate(sigmsg, vk): # open() before the joint multiplication
+    R = basic.bytes_to_element(sigmsg[:32])
+    A = basic.bytes_to_element(vk)
+    S = basic.bytes_to_scalar(sigmsg[32:64])
+    h = pure25519.Hint(sigmsg[:32] + vk + sigmsg[64:])
+    return basic.Base.scalarmult(S) == R.add(A.scalarmult(h))
+
+class TestJoint(unittest.TestCase):
+
+    def test_points(self): # a*B + b*P, jointly and separately
+        for i in range(20):
+            a, b = [int.from_bytes(os.urandom(32), 'little') % basic.L
+                    for k in range(2)]
+            P = pure25519.Base.scalarmult(int.from_bytes(os.urandom(32),
+                                                         'big'))
+            self.assertEqual(basic.Element(basic.double_scalarmult_vartime(
+                                                          a, P.XYTZ, b)),
+                             basic.Base.scalarmult(a).add(P.scalarmult(b)))
+        P = pure25519.Base.scalarmult(7) # small and zero scalars
+        for a, b in [(0, 0), (0, 1), (1, 0), (1, basic.L - 1), (16, 31)]:
+            self.assertEqual(basic.Element(basic.double_scalarmult_vartime(
+                                                          a, P.XYTZ, b)),
+                             basic.Base.scalarmult(a).add(P.scalarmult(b)))
+
+    def test_verdicts(self): # good signatures and ones with a bit flipped
+        vk, skvk = pure25519.publickey(os.urandom(32))
+        for i in range(16):
+            sigmsg = pure25519.sign(os.urandom(64), skvk)
+            alt = bytearray(sigmsg)
+            alt[[0, 32, 64, 100][i % 4]] ^= 1 << (i % 8)
+            for sm in [sigmsg, bytes(alt)]:
+                try:
+                    ok = open_separate(sm, vk)
+                except (ValueError, basic.NotOnCurve): # bad encoding of R
+                    ok = False
+                self.assertEqual(verdict(vk, sm[:64], sm[64:]), ok)
+            self.assertTrue(verdict(vk, sigmsg[:64], sigmsg[64:]))
+
+class TestVerifyBatch(unittest.TestCase):
+
+    def test_good(self):
+        items = signed(3) + signed(2)
+        self.assertEqual(pure25519.verify_batch(items), 5 * [True])
+
+    def test_bad_key(self): # not decodable, and the same key again
+        for vk in [bytes(32), (2).to_bytes(32, 'little')]:
+            items = [(vk, sig, msg) for _, sig, msg in signed(2)]
+            self.assertEqual(pure25519.verify_batch(items), [False, False])
+            items = signed(1) + items + signed(1)
+            self.assertEqual(pure25519.verify_batch(items),
+                             [True, False, False, True])
+
+    def test_non_canonical_s(self): # S+L, rejected as by RFC 8032
+        items = signed(2)
+        vk, sig, msg = items[0]
+        S = basic.bytes_to_scalar(sig[32:]) + basic.L
+        sig = sig[:32] + S.to_bytes(32, 'little')
+        self.assertTrue(open_separate(sig + msg, vk)) # same point
+        self.assertFalse(verdict(vk, sig, msg))
+        self.assertEqual(pure25519.verify_batch([(vk, sig, msg)] + items),
+                         [False, True, True])
+
+    def test_mixed(self): # bad key, bad signature, bad message, good ones
+        good = signed(4)
+        vk, sig, msg = good[0]
+        items = [(bytes(32), sig, msg), good[1], (vk, sig, msg + b'x'),
+                 (bytes(32), sig, msg), good[2], (vk, bytes(64), msg),
+                 (vk, sig[:32] + bytes(32), msg), good[3], (vk[:31], sig, msg)]
+        expected = [verdict(*x) if len(x[0]) == 32 else False for x in items]
+        self.assertEqual(expected, [False, True, False, False, True, False,
+                                    False, True, False])
+        self.assertEqual(pure25519.verify_batch(items), expected)
+
+def fake_cryptography(lax=False): # stand-in modules, on top of pure25519
+    # lax: take S mod L, as if the library did not check S < L
+    class InvalidSignature(Exception):
+        pass
+    class Ed25519PublicKey:
+        def __init__(self, pk):
+            self.pk = pk
+        @classmethod
+        def from_public_bytes(cls, pk):
+            if len(pk) != 32:
+                raise ValueError('bad key length')
+            return cls(pk)
+        def verify(self, sig, msg):
+            if lax:
+                S = basic.bytes_to_scalar(sig[32:]) % basic.L
+                sig = sig[:32] + S.to_bytes(32, 'little')
+            try:
+                pure25519.open(sig + msg, self.pk)
+            except pure25519.BadSignatureError:
+                raise InvalidSignature()
+    class Ed25519PrivateKey:
+        def __init__(self, seed):
+            self.skvk = pure25519.publickey(seed)[1]
+        @classmethod
+        def from_private_bytes(cls, seed):
+            return cls(seed)
+        def sign(self, msg):
+            return pure25519.sign(msg, self.skvk)[:64]
+    mods = {}
+    for n in ['cryptography', 'cryptography.exceptions',
+              'cryptography.hazmat', 'cryptography.hazmat.primitives',
+              'cryptography.hazmat.primitives.asymmetric',
+              'cryptography.hazmat.primitives.asymmetric.ed25519']:
+        mods[n] = types.ModuleType(n)
+    mods['cryptography.exceptions'].InvalidSignature = InvalidSignature
+    ed = mods['cryptography.hazmat.primitives.asymmetric.ed25519']
+    ed.Ed25519PublicKey = Ed25519PublicKey
+    ed.Ed25519PrivateKey = Ed25519PrivateKey
+    for n, m in mods.items(): # submodules are attributes of their parent
+        if '.' in n:
+            parent, name = n.rsplit('.', 1)
+            setattr(mods[parent], name, m)
+    return mods
+
+class TestBackends(unittest.TestCase):
+
+    def test_cryptography(self):
+        with mock.patch.dict(sys.modules, fake_cryptography()):
+            b = crypto.load('cryptography')
+            self.assertEqual(crypto.selftest([b]), ['cryptography'])
+            self.assertEqual(crypto.get_backend('cryptography').name,
+                             'cryptography')
+            items = signed(2) + [(bytes(31), bytes(64), b'')]
+            self.assertEqual(b.verify_batch(items), [True, True, False])
+
+    def test_lax(self): # a backend accepting S+L fails the selftest
+        with mock.patch.dict(sys.modules, fake_cryptography(lax=True)):
+            b = crypto.load('cryptography')
+            self.assertEqual(crypto.selftest([b]), [])
+            self.assertRaises(ValueError, crypto.get_backend, 'cryptography')
+
+    def test_missing(self): # not installed: skipped, pure25519 is the last
+        with mock.patch.dict(sys.modules, {'nacl': None,
+                                           'cryptography': None}):
+            self.assertEqual(crypto.load('cryptography'), None)
+            self.assertEqual(crypto.get_backend().name, 'pure25519')
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof
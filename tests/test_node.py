@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+# tests/test_node.py
+# PubNode: ingesting entries from the wire
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pure25519
+from simplepub import node, replica
+
+VERIFY = lambda pk,sig,msg: True
+
+def make_feed(path, n): # fid, [entry pkts] of a new feed with n entries
+    fid, skvk = pure25519.publickey(os.urandom(32))
+    author = replica.Replica(path, fid, VERIFY, is_author=True)
+    for i in range(n):
+        author.write48(os.urandom(48), lambda m: pure25519.sign(m, skvk)[:64])
+    return fid, [bytes(author.get_entry_pkt(s)) for s in range(1, n+1)]
+
+class TestIngest(unittest.TestCase):
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.dst = tempfile.mkdtemp()
+        self.fid, self.pkts = make_feed(self.src, 3)
+        replica.Replica(self.dst, self.fid, VERIFY).flush() # known, empty
+        self.node = node.PubNode(self.dst, 'in')
+        self.dmx = self.node.compute_dmx(self.fid + (1).to_bytes(4, 'big') +
+                                         self.fid[:20])
+
+    def tearDown(self):
+        self.node.close()
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dst)
+
+    def ingest_all(self):
+        for pkt in self.pkts:
+            self.node.rx(pkt)
+        self.node.tick()
+        return self.node._frontier(self.fid)[0]
+
+    def test_wrong_length(self): # rejected, the filter stays armed
+        self.node.rx(self.dmx + bytes(114))
+        self.node.tick()
+        self.assertEqual(self.ingest_all(), 3)
+
+    def test_forged_entry(self): # bad signature, re-armed at the flush
+        self.node.rx(self.dmx + bytes(113))
+        self.node.tick()
+        self.assertEqual(self.ingest_all(), 3)
+
+    def test_ingest_error(self): # the feed is re-armed even if ingest fails
+        rep = self.node._replica(self.fid)
+        def fail(pkts, seq):
+            raise OSError('disk full')
+        rep.ingest_entry_pkts = fail
+        self.node.rx(self.pkts[0])
+        self.assertRaises(OSError, self.node.tick)
+        del rep.ingest_entry_pkts
+        self.assertEqual(self.ingest_all(), 3)
+
+class TestBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.dst = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dst)
+
+    def test_lazy_summary(self): # closed feeds count against the node budget
+        fid, skvk = pure25519.publickey(os.urandom(32))
+        author = replica.Replica(tempfile.mkdtemp(dir=self.dst), fid, VERIFY,
+                                 is_author=True)
+        author.write(os.urandom(5000), lambda m: pure25519.sign(m, skvk)[:64])
+        rep = replica.Replica(self.dst, fid, VERIFY)
+        rep.ingest_entry_pkts([author.get_entry_pkt(1)], 1)
+        rep.flush()
+        pend = rep.get_pending_bytes()
+        self.assertTrue(pend > 0)
+        n = node.PubNode(self.dst, 'in', lazy=1, node_pend_max=pend)
+        n.close() # writes the summary
+        n = node.PubNode(self.dst, 'in', lazy=1, node_pend_max=pend)
+        self.assertTrue(fid in n.summ)
+        self.assertEqual(n.budget.get_stats()['used'], pend)
+        self.assertFalse(n.budget.reserve(os.urandom(32), 120))
+        n.close()
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof
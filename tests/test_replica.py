@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+# tests/test_replica.py
+# log segments of a replica
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pure25519
+from simplepub import bipf, cache, pack, replica
+
+VERIFY = lambda pk,sig,msg: True
+
+def make_feed(path, n): # fid, [entry pkts] of a new feed with n entries
+    fid, skvk = pure25519.publickey(os.urandom(32))
+    author = replica.Replica(path, fid, VERIFY, is_author=True)
+    for i in range(n):
+        author.write48(os.urandom(48), lambda m: pure25519.sign(m, skvk)[:64])
+    return fid, [bytes(author.get_entry_pkt(s)) for s in range(1, n+1)]
+
+def chain_entries(fid, lens): # entry pkts announcing chains of these lengths
+    pkts, prev = [], fid[:20]
+    for seq, n in enumerate(lens, 1):
+        nam = replica.PFX + fid + seq.to_bytes(4, 'big') + prev
+        sz = bipf.varint_encode_to_bytes(n)
+        msg = hashlib.sha256(nam).digest()[:7] + \
+              bytes([replica.PKTTYPE_chain20]) + sz + bytes(28 - len(sz)) + \
+              os.urandom(20)
+        pkts.append(msg + bytes(64)) # VERIFY accepts any signature
+        prev = hashlib.sha256(nam + pkts[-1]).digest()[:20]
+    return pkts
+
+class TestSegments(unittest.TestCase):
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.dst = tempfile.mkdtemp()
+        self.fid, self.pkts = make_feed(self.src, 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dst)
+
+    def check_rotation(self, rep): # map a segment, then let it be sealed
+        self.assertEqual(rep.ingest_entry_pkts(self.pkts[:1], 1), 1)
+        self.assertEqual(bytes(rep.get_entry_pkt(1)), self.pkts[0])
+        self.assertEqual(rep.ingest_entry_pkts(self.pkts[1:], 2), 19)
+        for seq in range(1, 21):
+            self.assertEqual(bytes(rep.get_entry_pkt(seq)), self.pkts[seq-1])
+
+    def test_mmap_rotation(self):
+        with mock.patch.object(replica, 'LOG_SEG_MAX', 1000):
+            rep = replica.Replica(self.dst, self.fid, VERIFY, use_mmap=True)
+            self.check_rotation(rep)
+            self.assertTrue(len(rep.get_segments()) > 1)
+
+    def test_beyond_4gib(self): # sidechain space is a hole, not written
+        pkts = chain_entries(self.fid, [10, 5 << 30, 10, 10])
+        rep = replica.Replica(self.dst, self.fid, VERIFY)
+        self.assertEqual(rep.ingest_entry_pkts(pkts, 1), 4)
+        starts = [rep._entry_pos(s) for s in range(1, 5)]
+        self.assertTrue(starts[2] > 1 << 32)
+        os.remove(rep.idx_fname) # rebuilt from the back pointers
+        rep = replica.Replica(self.dst, self.fid, VERIFY)
+        self.assertEqual([rep._entry_pos(s) for s in range(1, 5)], starts)
+        for seq in range(1, 5):
+            self.assertEqual(bytes(rep.get_entry_pkt(seq)), pkts[seq-1])
+
+    def test_pack_mmap_rotation(self):
+        with mock.patch.object(pack, 'SEG_MAX', 1000):
+            store = pack.PackStore(self.dst, cache.FilePool(16), 'none', True)
+            rep = pack.PackReplica(store, self.fid, VERIFY)
+            self.check_rotation(rep)
+            self.assertTrue(store.tail >> 32 > 0)
+
+class TestIter(unittest.TestCase):
+
+    def setUp(self):
+        self.src = tempfile.mkdtemp()
+        self.dst = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.src)
+        shutil.rmtree(self.dst)
+
+    def test_pending_not_read(self): # only entry pkts of a pending chain
+        fid, skvk = pure25519.publickey(os.urandom(32))
+        sign = lambda m: pure25519.sign(m, skvk)[:64]
+        author = replica.Replica(self.src, fid, VERIFY, is_author=True)
+        content = [b'a', os.urandom(300000), b'b', os.urandom(1000), b'c']
+        for c in content:
+            author.write(c, sign)
+        rep = replica.Replica(self.dst, fid, VERIFY)
+        pkts = [author.get_entry_pkt(s) for s in range(1, 6)]
+        self.assertEqual(rep.ingest_entry_pkts(pkts, 1), 5)
+        for cnr in range(author.get_content_len(4)[1]): # complete it
+            rep.ingest_chunk_pkt(author.get_chunk_pkt(4, cnr), 4)
+        self.assertEqual(list(rep.get_open_chains()), [2])
+        sizes = []
+        read_log = rep._read_log
+        def traced(pos, cnt):
+            sizes.append(cnt)
+            return read_log(pos, cnt)
+        rep._read_log = traced
+        self.assertEqual([bytes(e) for _, e in rep.iter_entries()],
+                         [bytes(p) for p in pkts])
+        self.assertTrue(max(sizes) <= replica.ITER_BLOCK)
+        sizes.clear()
+        got = [None if c == None else bytes(c)
+               for _, _, c in rep.iter_content()]
+        self.assertEqual(got, [b'a', None, b'b', content[3], b'c'])
+        self.assertTrue(max(sizes) <= replica.ITER_BLOCK)
+
+class TestPack(unittest.TestCase):
+
+    def setUp(self):
+        self.dst = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dst)
+
+    def test_author(self): # write48() and write(), as for a 2FPF replica
+        fid, skvk = pure25519.publickey(os.urandom(32))
+        sign = lambda m: pure25519.sign(m, skvk)[:64]
+        content = [b'a', os.urandom(3000), b'b', os.urandom(300)]
+        with mock.patch.object(pack, 'SEG_MAX', 2000):
+            store = pack.PackStore(self.dst, cache.FilePool(16))
+            rep = pack.PackReplica(store, fid, VERIFY)
+            for c in content:
+                seq = rep.write48(c, sign) if len(c) == 1 else \
+                      rep.write(c, sign)
+                self.assertEqual(seq, rep.state['max_seq'])
+            segs = rep.get_segments()
+            self.assertTrue(len(segs) > 1)
+            self.assertEqual([s[2] for s in segs],
+                             [True] * (len(segs) - 1) + [False])
+            store.close()
+            store = pack.PackStore(self.dst, cache.FilePool(16))
+            rep = pack.PackReplica(store, fid, VERIFY)
+        self.assertEqual(rep.state['max_seq'], 4)
+        self.assertEqual([bytes(rep.read(s)).rstrip(b'\x00')
+                          for s in (1, 3)], [b'a', b'b'])
+        self.assertEqual([rep.read(s) for s in (2, 4)], content[1::2])
+
+if __name__ == '__main__':
+    unittest.main()
+
+# eof